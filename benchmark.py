@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import cv2 as cv
+
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene
+
+from images import Image, Mixer4images
+from main import MainWindow
+
+# Benchmarks of the load -> FFT -> weight -> mix -> display path on synthetic images.
+# Every stage is timed (median of --repeat runs) and its peak traced memory is measured in a separate run.
+# Results can be saved as a baseline and later runs compared against it:
+#   python benchmark.py --sizes 256 512 1024 --save-baseline
+#   python benchmark.py --sizes 256 512 1024 --compare
+# --accuracy compares the single precision mode (MIXER_SINGLE_PRECISION) with double precision instead.
+
+DEFAULT_SIZES = [256, 512, 1024, 2048]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def synthetic_image(size, seed):
+    # smooth gradients plus texture, so the spectra are not degenerate
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    image = 127 + 60 * np.sin(2 * np.pi * (seed + 1) * x) * np.cos(2 * np.pi * (seed + 2) * y)
+    image += rng.normal(0, 20, (size, size))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def measure(function, repeat):
+    # (median seconds, peak traced bytes) of a stage
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def pipeline_stages(size, directory):
+    # (stage name, callable) pairs for one image size, sharing their inputs
+    image = Image()
+    paths = []
+    for i in range(4):
+        path = os.path.join(directory, f"bench_{size}_{i}.png")
+        cv.imwrite(path, synthetic_image(size, i))
+        paths.append(path)
+    images = [image.read_grayscale(path) for path in paths]
+    spectra = [image.fourier_transform(data) for data in images]
+    shape = images[0].shape
+
+    mask = image.half_mask(image.rect_region(shape, size // 4, size // 4, size // 2, size // 2))
+
+    def load():
+        Image().load_image(paths[0], 'view')
+
+    def mix(mode, components, region):
+        def run():
+            mixer = Mixer4images()
+            weights = {}
+            for i, spectrum in enumerate(spectra):
+                mixer.update(weights, components[i % 2], spectrum, 50 + 10 * i, i,
+                             mask if region else None, True if region else None, shape, None, mode)
+            mixer.compose(weights, shape, mode)
+        return run
+
+    # a slider move in real/imaginary mode once the spatial contributions are cached
+    warm_mixer, warm_weights = Mixer4images(), {}
+    for i, spectrum in enumerate(spectra):
+        warm_mixer.update(warm_weights, ('Real', 'Imaginary')[i % 2], spectrum, 50, i, None, None, shape, (i, 0),
+                          "real_imaginary mode")
+
+    def slider_tick():
+        warm_mixer.update(warm_weights, 'Real', spectra[0], 70, 0, None, None, shape, (0, 0), "real_imaginary mode")
+        warm_mixer.compose(warm_weights, shape, "real_imaginary mode")
+
+    mixer = Mixer4images()
+    weighted = mixer.apply_weights(70, 'Magnitude', spectra[0])
+    output = mixer.compose({0: {'Magnitude': weighted, 'Phase': mixer.apply_weights(100, 'Phase', spectra[1])}},
+                           shape, "magnitude_phase mode")
+    spectrum = spectra[0] if image.real_fft else np.fft.ifftshift(spectra[0])
+
+    view = QGraphicsView()
+    view.setScene(QGraphicsScene())
+
+    return [
+        ("load_image", load),
+        ("fourier_transform", lambda: image.fourier_transform(images[0])),
+        ("apply_weights", lambda: mixer.apply_weights(70, 'Magnitude', spectra[0])),
+        ("apply_weights+region", lambda: mixer.apply_weights(70, 'Magnitude', spectra[0], mask, True)),
+        ("mix_magnitude_phase", mix("magnitude_phase mode", ('Magnitude', 'Phase'), False)),
+        ("mix_magnitude_phase+region", mix("magnitude_phase mode", ('Magnitude', 'Phase'), True)),
+        ("mix_real_imaginary", mix("real_imaginary mode", ('Real', 'Imaginary'), False)),
+        ("mix_real_imaginary+region", mix("real_imaginary mode", ('Real', 'Imaginary'), True)),
+        ("mix_real_imaginary(cached)", slider_tick),
+        ("inverseFourier", lambda: image.inverseFourier(spectrum, shape)),
+        ("displayImage", lambda: MainWindow.displayImage(None, view, output)),
+    ]
+
+
+def accuracy(sizes):
+    # difference between the single and double precision outputs of every mix, in gray levels of the uint8 output
+    # and relative to the largest value of the double precision output before it is mapped to 8 bits
+    results = {}
+    for size in sizes:
+        images = [synthetic_image(size, i) for i in range(4)]
+        shape = images[0].shape
+        for mode, components in (("magnitude_phase mode", ('Magnitude', 'Phase')),
+                                 ("real_imaginary mode", ('Real', 'Imaginary'))):
+            for region in (False, True):
+                outputs = []
+                for single in (False, True):
+                    image = Image(single_precision=single)
+                    mixer = Mixer4images(image)
+                    mask = image.half_mask(image.rect_region(shape, size // 4, size // 4, size // 2, size // 2))
+                    weights = {}
+                    for i, data in enumerate(images):
+                        mixer.update(weights, components[i % 2], image.fourier_transform(data), 50 + 10 * i, i,
+                                     mask if region else None, True if region else None, shape, None, mode)
+                    # the same mix before the 8 bit mapping, for the relative error
+                    if mode == "magnitude_phase mode":
+                        spectrum = mixer.mix_magnitude_phase([info['Magnitude'] for info in weights.values()],
+                                                             [info['Phase'] for info in weights.values()])
+                        if not image.real_fft:
+                            spectrum = np.fft.ifftshift(spectrum)
+                        raw = image.inverseFourier(spectrum, shape)
+                    else:
+                        raw = mixer.spatial_sum(shape)
+                    outputs.append((raw.astype(np.float64), mixer.compose(weights, shape, mode).astype(int)))
+                (raw64, out64), (raw32, out32) = outputs
+                name = f"{mode.split()[0]}{'+region' if region else ''}@{size}"
+                results[name] = {'max_gray_levels': int(np.abs(out64 - out32).max()),
+                                 'changed_pixels': float(np.mean(out64 != out32)),
+                                 'max_relative': float(np.abs(raw64 - raw32).max() / max(np.abs(raw64).max(), 1e-12))}
+                print(f"{name:<36} max {results[name]['max_gray_levels']} gray levels, "
+                      f"{results[name]['changed_pixels'] * 100:.3f}% pixels changed, "
+                      f"max relative error {results[name]['max_relative']:.2e}")
+    return results
+
+
+def run(sizes, repeat):
+    # displayImage needs a (headless) Qt application
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for name, function in pipeline_stages(size, directory):
+                seconds, peak = measure(function, repeat)
+                results[f"{name}@{size}"] = {'seconds': seconds, 'peak_bytes': peak}
+                print(f"{name + '@' + str(size):<36} {seconds * 1000:10.2f} ms {peak / 2 ** 20:10.1f} MiB")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # stages slower (or hungrier) than tolerance x baseline
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get('results', {}).get(key)
+        if reference is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if reference[metric] > 0 and result[metric] > tolerance * reference[metric]:
+                regressions.append((key, metric, reference[metric], result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Fourier mixer pipeline.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="square image sizes to benchmark (e.g. 256 512 ... 8192)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per stage (median is reported)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline file")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="fail if a stage regressed against the baseline")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="allowed ratio to the baseline before a stage counts as a regression")
+    parser.add_argument('--accuracy', action='store_true',
+                        help="compare the single precision outputs with double precision instead of timing")
+    args = parser.parse_args(argv)
+
+    if args.accuracy:
+        accuracy(args.sizes)
+        return 0
+
+    results = run(args.sizes, args.repeat)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'results': results}, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}", file=sys.stderr)
+            return 2
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for key, metric, reference, value in regressions:
+            print(f"REGRESSION {key} {metric}: {reference:.4g} -> {value:.4g}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# working set the spectrum cache is sized for: the four views at 4096x4096, each with its complex128 spectrum
+# (256 MiB) and two float64 component planes (128 MiB each), plus ~10% for preview levels and full-spectrum
+# display planes
+WORKING_SET_MB = 4 * (256 + 2 * 128) * 11 // 10
+
+
+def default_spectrum_cache_mb():
+    # the working set, but never more than half of the physical memory
+    try:
+        physical_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return WORKING_SET_MB
+    return max(512, min(WORKING_SET_MB, physical_mb // 2))
+
+
+# memory budget (in megabytes) of the spectrum cache, can be overridden with MIXER_SPECTRUM_CACHE_MB
+SPECTRUM_CACHE_MB = int(os.environ.get("MIXER_SPECTRUM_CACHE_MB", "0")) or default_spectrum_cache_mb()
+# budget of the mixer's cached spatial-domain contributions (real/imaginary mode)
+CONTRIBUTION_CACHE_MB = int(os.environ.get("MIXER_CONTRIBUTION_CACHE_MB", "256"))
+# budget of the mixed output images, and the weight step (in %) below which two weights share a cached output
+RESULT_CACHE_MB = int(os.environ.get("MIXER_RESULT_CACHE_MB", "64"))
+RESULT_WEIGHT_STEP = float(os.environ.get("MIXER_RESULT_WEIGHT_STEP", "1"))
+
+
+# Least-recently-used cache whose size is bounded by the number of bytes held by its values
+# (numpy arrays or tuples/lists of numpy arrays) instead of the number of entries.
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def size_of(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(LRUCache.size_of(item) for item in value)
+        return 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            # mark as most recently used
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = self.size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            # values larger than the whole budget are never cached
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            # evict least recently used entries until we are back within budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.current_bytes -= entry[1]
+            return entry[0]
+
+    def invalidate(self, predicate):
+        # drop every entry whose key satisfies the predicate
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+# Cache of Fourier transforms keyed by (image id, image version, ...).
+# The image id identifies where the image lives (e.g. its view) and the version changes every time
+# the image data changes, so a stale spectrum can never be returned for an edited image.
+class SpectrumCache(LRUCache):
+    def __init__(self, max_bytes=SPECTRUM_CACHE_MB * 1024 * 1024):
+        super().__init__(max_bytes)
+
+    def get_spectrum(self, key, image, transform):
+        spectrum = self.get(key)
+        if spectrum is None:
+            spectrum = transform(image)
+            # cached spectra are shared between callers, so they must never be modified in place
+            spectrum.flags.writeable = False
+            self.put(key, spectrum)
+        return spectrum
+
+    def get_component(self, key, component, spectrum, extract):
+        # component plane (magnitude, phase, unit phasor, real or imaginary part) of the spectrum cached under key,
+        # kept as a contiguous read-only array next to it, so it is computed once per image version and dropped
+        # with it by invalidate_image
+        plane_key = key + (component,)
+        plane = self.get(plane_key)
+        if plane is None:
+            plane = np.ascontiguousarray(extract(component, spectrum))
+            if plane is spectrum or plane.base is not None:
+                # real/imaginary parts are views of the spectrum: keep a copy of their own
+                plane = plane.copy()
+            plane.flags.writeable = False
+            self.put(plane_key, plane)
+        return plane
+
+    def invalidate_image(self, image_id, keep=None):
+        # free every spectrum computed for any version of the given image, except version keep
+        self.invalidate(lambda key: key[0] == image_id and key[1] != keep)
+
+
+# Cache of mixed output images keyed by everything that determines them (image versions, components, quantized
+# weights, regions, mode and output resolution), so scrubbing a slider back to a position it already visited
+# returns the output instantly. hits/misses count the lookups, to size the budget.
+class ResultCache(LRUCache):
+    def __init__(self, max_bytes=RESULT_CACHE_MB * 1024 * 1024, weight_step=RESULT_WEIGHT_STEP):
+        super().__init__(max_bytes)
+        self.weight_step = weight_step
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, weight):
+        return round(weight / self.weight_step) if self.weight_step > 0 else weight
+
+    def lookup(self, key):
+        result = self.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self), 'bytes': self.current_bytes}
@@ -0,0 +1,238 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import cv2 as cv
+
+from images import Image
+from engine import MixEngine
+
+# Headless mixer: runs mixing recipes without the Qt window.
+#
+# A recipe is a JSON object (a recipe file holds one recipe or a list of them):
+#   {
+#     "images": [{"path": "a.png", "component": "Magnitude", "weight": 80},
+#                {"path": "b.png", "component": "Phase", "weight": 100}],
+#     "region": {"x": 0.25, "y": 0.25, "width": 0.5, "height": 0.5, "inside": true},
+#     "scaling": "clip",
+#     "output": "mixed.png"
+#   }
+# Paths are relative to the recipe file. "region" is optional; its rectangle is given as fractions of the
+# (centred) spectrum, like the region drawn on the FT views, and "inside" selects which side of it is kept.
+# A region can also be a frequency mask (see Image.frequency_mask), with radii as fractions of the Nyquist
+# frequency: {"type": "lowpass" | "highpass" | "gaussian", "cutoff": 0.2}, {"type": "bandpass", "low": 0.1,
+# "high": 0.3} or {"type": "butterworth", "cutoff": 0.2, "order": 2}; "inside": false keeps the complement.
+# All images of a recipe are fitted to one common shape, as in the GUI (see shapes.py).
+
+COMPONENT_MODES = {
+    'Magnitude': "magnitude_phase mode",
+    'Phase': "magnitude_phase mode",
+    'Real': "real_imaginary mode",
+    'Imaginary': "real_imaginary mode",
+}
+
+
+class Source:
+    def __init__(self, path, component, weight):
+        if component not in COMPONENT_MODES:
+            raise ValueError(f"Unknown component '{component}' for {path}")
+        self.path = path
+        self.component = component
+        self.weight = weight
+
+
+class Recipe:
+    def __init__(self, sources, output, region=None, scaling="clip", name=""):
+        if not sources:
+            raise ValueError(f"Recipe {name} has no images")
+        modes = {COMPONENT_MODES[source.component] for source in sources}
+        if len(modes) > 1:
+            raise ValueError(f"Recipe {name} mixes magnitude/phase with real/imaginary components")
+        if not output:
+            raise ValueError(f"Recipe {name} has no output path")
+        self.sources = sources
+        self.output = output
+        self.region = region
+        self.scaling = scaling
+        self.name = name
+        self.mode = modes.pop()
+        self.shape = None  # common (height, width), known once the images are loaded
+
+    @classmethod
+    def from_dict(cls, data, base_dir="", name=""):
+        sources = [Source(os.path.join(base_dir, item['path']), item['component'], float(item.get('weight', 100)))
+                   for item in data.get('images', [])]
+        output = data.get('output')
+        if output:
+            output = os.path.join(base_dir, output)
+        return cls(sources, output, data.get('region'), data.get('scaling', "clip"), name)
+
+
+def load_recipes(paths):
+    # every path is a recipe file or a directory of *.json recipe files
+    recipes = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+        for file_path in files:
+            with open(file_path) as recipe_file:
+                data = json.load(recipe_file)
+            base_dir = os.path.dirname(os.path.abspath(file_path))
+            items = data if isinstance(data, list) else [data]
+            for i, item in enumerate(items):
+                name = file_path if len(items) == 1 else f"{file_path}[{i}]"
+                recipes.append(Recipe.from_dict(item, base_dir, name))
+    return recipes
+
+
+def region_mask(region, shape, image):
+    # Region of the rectangle on the centred (shifted) spectrum, or a frequency mask
+    kind = region.get('type', 'rect')
+    if kind != 'rect':
+        return image.frequency_mask(kind, shape, region.get('cutoff', 0.5), region.get('low', 0.0),
+                                    region.get('high', 1.0), region.get('order', 2))
+    height, width = shape
+    return image.rect_region(shape, int(region.get('x', 0) * width), int(region.get('y', 0) * height),
+                             int(region.get('width', 1) * width), int(region.get('height', 1) * height))
+
+
+def load_spectra(recipes, image):
+    # decode every image once, then transform it once per target shape it is used at;
+    # returns the spectra, the recipes whose images could all be read and the failures of the others
+    images, loaded, failures = {}, [], []
+    for recipe in recipes:
+        try:
+            for source in recipe.sources:
+                if source.path not in images:
+                    images[source.path] = image.read_grayscale(source.path)
+        except IOError as e:
+            failures.append((recipe.name, str(e)))
+            continue
+        recipe.shape = image.normalizer.target_shape(images[source.path].shape for source in recipe.sources)
+        loaded.append(recipe)
+
+    spectra = {}
+    for recipe in loaded:
+        for source in recipe.sources:
+            key = (source.path, recipe.shape)
+            if key not in spectra:
+                spectra[key] = image.fourier_transform(
+                    image.normalizer.normalize(source.path, images[source.path], recipe.shape))
+    return spectra, loaded, failures
+
+
+def mix_recipe(recipe, spectra, engine):
+    mask, flag = None, None
+    if recipe.region:
+        mask = engine.image.half_mask(region_mask(recipe.region, recipe.shape, engine.image))
+        flag = recipe.region.get('inside', True)
+    # the engine keeps its stack between recipes and only refills the slots whose source changed
+    engine.set_sources([((source.path, recipe.shape), spectra[(source.path, recipe.shape)])
+                        for source in recipe.sources])
+    count = len(recipe.sources)
+    return engine.mix([source.component for source in recipe.sources], [source.weight for source in recipe.sources],
+                      recipe.mode, [mask] * count, [flag] * count, recipe.shape, recipe.scaling)
+
+
+def write_output(recipe, image):
+    directory = os.path.dirname(recipe.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if not cv.imwrite(recipe.output, image):
+        raise IOError(f"Could not write {recipe.output}")
+
+
+# --- process pool: the spectra live in shared memory, every worker maps them read-only ---
+
+_worker_spectra = {}
+_worker_blocks = []
+_worker_engine = None
+
+
+def share_spectra(spectra):
+    blocks, layout = [], {}
+    for key, spectrum in spectra.items():
+        block = shared_memory.SharedMemory(create=True, size=max(1, spectrum.nbytes))
+        np.ndarray(spectrum.shape, spectrum.dtype, buffer=block.buf)[...] = spectrum
+        blocks.append(block)
+        layout[key] = (block.name, spectrum.shape, spectrum.dtype.str)
+    return blocks, layout
+
+
+def init_worker(layout):
+    # workers share the parent's resource tracker, so the blocks stay alive until the parent unlinks them
+    global _worker_engine
+    for key, (name, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=name)
+        spectrum = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        spectrum.flags.writeable = False
+        _worker_spectra[key] = spectrum
+        _worker_blocks.append(block)  # keeps the mapping alive
+    _worker_engine = MixEngine()
+
+
+def run_in_worker(recipe):
+    try:
+        write_output(recipe, mix_recipe(recipe, _worker_spectra, _worker_engine))
+        return recipe.name, None
+    except Exception as e:
+        return recipe.name, str(e)
+
+
+def run_recipes(recipes, jobs=1):
+    # returns a list of (recipe name, error) for the recipes that failed
+    image = Image()
+    spectra, recipes, failures = load_spectra(recipes, image)
+    if jobs <= 1:
+        engine = MixEngine(image)
+        for recipe in recipes:
+            try:
+                write_output(recipe, mix_recipe(recipe, spectra, engine))
+            except Exception as e:
+                failures.append((recipe.name, str(e)))
+        return failures
+
+    blocks, layout = share_spectra(spectra)
+    del spectra
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(layout,)) as pool:
+            chunksize = max(1, len(recipes) // (jobs * 8))
+            for name, error in pool.map(run_in_worker, recipes, chunksize=chunksize):
+                if error is not None:
+                    failures.append((name, error))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mix images in the Fourier domain without the GUI.")
+    parser.add_argument('recipes', nargs='+', help="recipe JSON files or directories of recipe files")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes for batch runs (default: 1, no pool)")
+    args = parser.parse_args(argv)
+
+    try:
+        recipes = load_recipes(args.recipes)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid recipe: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    failures = run_recipes(recipes, args.jobs)
+    elapsed = time.perf_counter() - start
+    for name, error in failures:
+        print(f"{name}: {error}", file=sys.stderr)
+    print(f"Mixed {len(recipes) - len(failures)}/{len(recipes)} recipes in {elapsed:.2f} s")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -260,37 +260,41 @@ class CustomGraphicsView(QGraphicsView):
         self.selected_handle = None
         
     def updateOtherCropItems(self, newPos, senderHandle):
-        # Update all CropItems except the one that contains the handle that emitted the signal
-        for cropItem in self.main_window.crop_items:
-            if senderHandle not in cropItem.sizeGripItem._handleItems:
-                # Find the corresponding handle in the other CropItem and set its position
-                for handle in cropItem.sizeGripItem._handleItems:
-                    if handle.positionflags() == senderHandle.positionflags():
-                        handle.setPos(newPos)
-                        # Call the respective function to adjust the size of the CropItem
-                        if handle.positionflags() == SizeGripItem.TopLeft:
-                            cropItem.sizeGripItem.setTopLeft(newPos)
-                        elif handle.positionflags() == SizeGripItem.Top:
-                            cropItem.sizeGripItem.setTop(newPos.y())
-                        elif handle.positionflags() == SizeGripItem.TopRight:
-                            cropItem.sizeGripItem.setTopRight(newPos)
-                        elif handle.positionflags() == SizeGripItem.Right:
-                            cropItem.sizeGripItem.setRight(newPos.x())
-                        elif handle.positionflags() == SizeGripItem.BottomRight:
-                            cropItem.sizeGripItem.setBottomRight(newPos)
-                        elif handle.positionflags() == SizeGripItem.Bottom:
-                            cropItem.sizeGripItem.setBottom(newPos.y())
-                        elif handle.positionflags() == SizeGripItem.BottomLeft:
-                            cropItem.sizeGripItem.setBottomLeft(newPos)
-                        elif handle.positionflags() == SizeGripItem.Left:
-                            cropItem.sizeGripItem.setLeft(newPos.x())
-                       
-            ft_label = self.main_window.FT_cropItems[cropItem]
-            combobox, value = self.main_window.get_slider_value(ft_label)
-            self.main_window.image_mixer(value, combobox)
-                    
+        # Update all CropItems except the one that contains the handle that emitted the signal.
+        # The size grip setters move the handles with geometry notifications off, so the linked items do not
+        # emit positionChanged back; the guard also stops any re-entrant call while the items are synced
+        if self.main_window.syncing_regions:
+            return
+        self.main_window.syncing_regions = True
+        try:
+            for cropItem in self.main_window.crop_items:
+                if senderHandle in cropItem.sizeGripItem._handleItems:
+                    continue
+                # adjust the size of the CropItem like its handle of the same kind would
+                flags = senderHandle.positionflags()
+                if flags == SizeGripItem.TopLeft:
+                    cropItem.sizeGripItem.setTopLeft(newPos)
+                elif flags == SizeGripItem.Top:
+                    cropItem.sizeGripItem.setTop(newPos.y())
+                elif flags == SizeGripItem.TopRight:
+                    cropItem.sizeGripItem.setTopRight(newPos)
+                elif flags == SizeGripItem.Right:
+                    cropItem.sizeGripItem.setRight(newPos.x())
+                elif flags == SizeGripItem.BottomRight:
+                    cropItem.sizeGripItem.setBottomRight(newPos)
+                elif flags == SizeGripItem.Bottom:
+                    cropItem.sizeGripItem.setBottom(newPos.y())
+                elif flags == SizeGripItem.BottomLeft:
+                    cropItem.sizeGripItem.setBottomLeft(newPos)
+                elif flags == SizeGripItem.Left:
+                    cropItem.sizeGripItem.setLeft(newPos.x())
+        finally:
+            self.main_window.syncing_regions = False
+        # one mix of every image per frame, with the final rectangle
+        self.main_window.regionChanged()
 
     def mousePressEvent(self, event):
+        self.drag = True
         super().mousePressEvent(event)
 
     def mouseMoveEvent(self, event):
@@ -298,5 +302,10 @@ class CustomGraphicsView(QGraphicsView):
 
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
+        if self.drag:
+            self.drag = False
+            if self.main_window.FT_regions:
+                # the region stopped moving: replace the preview with the full resolution mix
+                self.main_window.refineMix()
 
 
@@ -0,0 +1,133 @@
+import numpy as np
+
+import kernels
+from images import Image
+from instrument import instrumentation
+
+MODE_COMPONENTS = {
+    "magnitude_phase mode": ('Magnitude', 'Phase'),
+    "real_imaginary mode": ('Real', 'Imaginary'),
+}
+
+
+# Mixing engine over a stack of N spectra.
+# The spectra of all sources live in one contiguous (N, H, W) array and every component that is used (magnitude,
+# phase, real or imaginary part) is extracted once for the whole stack into another (N, H, W) plane. A mix is then
+# one weighted reduction over the first axis per component (np.tensordot), instead of one weighted temporary per
+# image summed in Python. Sources are identified by keys, so only the slots whose spectrum changed are refilled.
+# Region masks are linear in the reduction and are applied once per group of sources sharing the same mask.
+class MixEngine:
+    def __init__(self, image=None):
+        self.image = image or Image()
+        self.keys = []  # key of the spectrum in every slot
+        self.spectra = None  # (N, H, W) complex stack
+        self.planes = {}  # component -> (N, H, W) float stack, filled lazily
+        # complex outputs of the magnitude/phase recombination (the mix, and the mirrored side of half-spectrum
+        # regions), reused by every mix
+        self.spectrum_buffers = [None, None]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set_sources(self, sources):
+        # sources: list of (key, spectrum) pairs; a slot whose key is unchanged is not copied again
+        count = len(sources)
+        shape = sources[0][1].shape
+        dtype = np.result_type(*[spectrum.dtype for _, spectrum in sources])
+        if self.spectra is None or self.spectra.shape != (count,) + shape or self.spectra.dtype != dtype:
+            self.spectra = np.empty((count,) + shape, dtype=dtype)
+            self.keys = [None] * count
+            self.planes = {}
+        for slot, (key, spectrum) in enumerate(sources):
+            if key is not None and self.keys[slot] == key:
+                continue
+            self.spectra[slot] = spectrum
+            self.keys[slot] = key
+            for component, plane in self.planes.items():
+                self.extract(component, self.spectra[slot], plane[slot])
+
+    def extract(self, component, spectrum, out):
+        if component == 'Real':
+            np.copyto(out, spectrum.real)
+        elif component == 'Imaginary':
+            np.copyto(out, spectrum.imag)
+        elif component == 'Magnitude':
+            np.abs(spectrum, out=out)
+        elif component == 'Phase':
+            np.copyto(out, np.angle(spectrum))
+        else:
+            raise ValueError(f"Unknown component: {component}")
+
+    def plane(self, component):
+        plane = self.planes.get(component)
+        if plane is None:
+            with instrumentation.stage("component"):
+                plane = np.empty(self.spectra.shape, dtype=self.spectra.real.dtype)
+                self.extract(component, self.spectra, plane)
+            self.planes[component] = plane
+        return plane
+
+    def reduce(self, component, weights):
+        # sum over the sources of weight * component; weights is a vector with one entry per slot
+        return np.tensordot(weights, self.plane(component), axes=1)
+
+    @instrumentation.timed("mix")
+    def mix_spectrum(self, components, weights, mode, masks=None, flags=None, buffer=0):
+        # mixed spectrum of the stacked sources. components/weights (in %)/masks/flags: one entry per slot;
+        # components that do not belong to the mode are ignored, like in Mixer4images. A magnitude/phase mix is
+        # written into a persistent buffer, valid until the next mix
+        count = len(self.keys)
+        masks = masks or [None] * count
+        flags = flags or [None] * count
+        first, second = MODE_COMPONENTS[mode]
+        if mode == "magnitude_phase mode" and any(getattr(mask, 'mirror', None) is not None for mask in masks):
+            # asymmetric regions on the half spectrum: mean of the mixes of both sides (see images.HalfRegion)
+            regions = [getattr(mask, 'region', mask) for mask in masks]
+            mirrors = [getattr(mask, 'mirror', mask) for mask in masks]
+            spectrum = self.mix_spectrum(components, weights, mode, regions, flags)
+            spectrum += self.mix_spectrum(components, weights, mode, mirrors, flags, buffer=1)
+            spectrum *= 0.5
+            return spectrum
+
+        # sources sharing a region (and side) are reduced together and masked once
+        groups = {}
+        for slot in range(count):
+            group_key = None if masks[slot] is None else (masks[slot].key, bool(flags[slot]))
+            groups.setdefault(group_key, (masks[slot], flags[slot], []))[2].append(slot)
+
+        totals = []
+        for target in (first, second):
+            total = None
+            for mask, flag, slots in groups.values():
+                weights_vector = np.zeros(count, dtype=self.spectra.real.dtype)
+                for slot in slots:
+                    if components[slot] == target:
+                        weights_vector[slot] = weights[slot] / 100
+                if not weights_vector.any():
+                    continue
+                reduced = self.reduce(target, weights_vector)
+                if mask is not None:
+                    with instrumentation.stage("mask"):
+                        reduced = mask.apply(reduced, flag, reduced)
+                if total is None:
+                    total = reduced
+                else:
+                    total += reduced
+            if total is None:
+                total = np.zeros(self.spectra.shape[1:], dtype=self.spectra.real.dtype)
+            totals.append(total)
+
+        if mode == "magnitude_phase mode":
+            magnitude, phase = totals
+            out = kernels.recombine(magnitude, phase, self.spectrum_buffers[buffer])
+            self.spectrum_buffers[buffer] = out
+            return out
+        real, imaginary = totals
+        return real + 1j * imaginary
+
+    def mix(self, components, weights, mode, masks=None, flags=None, shape=None, scaling="clip"):
+        # mixed image (uint8); shape is the spatial shape, needed in half-spectrum mode
+        spectrum = self.mix_spectrum(components, weights, mode, masks, flags)
+        if not self.image.real_fft:
+            spectrum = np.fft.ifftshift(spectrum)
+        return self.image.to_uint8(self.image.inverseFourier(spectrum, shape), scaling)
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2 as cv
+
+from images import Image, Mixer4images
+from cache import SpectrumCache
+from cli import Recipe, load_spectra, region_mask
+
+# Weight-sweep animations: renders the output of a recipe (see cli.py) along a path of weights to a video,
+# a GIF or an image sequence.
+#   python export.py recipe.json sweep.mp4 --sweep 0 --frames 101
+#   python export.py recipe.json frames/ --keyframes 100,0,50,50 0,100,50,50 --frames 60
+# --sweep N moves the weight of image N from 0 to 100% (the others keep their recipe weights); --keyframes gives
+# the weights of all the images at evenly spaced keyframes, linearly interpolated in between.
+# Every spectrum is transformed once and mixed by Mixer4images with its component planes cached, so in
+# real/imaginary mode a frame is only a weighted sum of cached spatial contributions. Frames are streamed to the
+# encoder thread through a bounded queue, so an export never holds more than a few frames in memory.
+
+EXPORT_QUEUE_FRAMES = int(os.environ.get("MIXER_EXPORT_QUEUE", "8"))
+VIDEO_CODECS = {'.mp4': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+
+
+def weight_path(keyframes, frames):
+    # (frames, N) weights, linearly interpolated between evenly spaced keyframes
+    keyframes = np.asarray(keyframes, dtype=float)
+    if len(keyframes) == 1:
+        return np.repeat(keyframes, frames, axis=0)
+    positions = np.linspace(0, len(keyframes) - 1, frames)
+    return np.stack([np.interp(positions, np.arange(len(keyframes)), keyframes[:, i])
+                     for i in range(keyframes.shape[1])], axis=1)
+
+
+def sweep_keyframes(weights, index):
+    # weight of image index from 0 to 100%, the others fixed
+    start, end = list(weights), list(weights)
+    start[index], end[index] = 0, 100
+    return [start, end]
+
+
+class FrameWriter:
+    # writes uint8 grayscale frames to a video (by extension), a GIF or an image sequence (a directory, or a path
+    # with a %d pattern)
+    def __init__(self, path, fps, shape):
+        self.path = path
+        self.count = 0
+        self._video = None
+        self._gif = None
+        extension = os.path.splitext(path)[1].lower()
+        if extension in VIDEO_CODECS:
+            self._video = cv.VideoWriter(path, cv.VideoWriter_fourcc(*VIDEO_CODECS[extension]), fps,
+                                         (shape[1], shape[0]), isColor=False)
+            if not self._video.isOpened():
+                raise IOError(f"Could not open a {extension} video writer for {path}")
+        elif extension == '.gif':
+            try:
+                import imageio.v2 as imageio
+            except ImportError:
+                raise RuntimeError("GIF export needs imageio; write a video or an image sequence instead")
+            self._gif = imageio.get_writer(path, mode='I', duration=1 / fps)
+        else:
+            if '%' not in path:
+                os.makedirs(path, exist_ok=True)
+                path = os.path.join(path, "frame_%04d.png")
+            self.pattern = path
+
+    def write(self, frame):
+        if self._video is not None:
+            self._video.write(frame)
+        elif self._gif is not None:
+            self._gif.append_data(frame)
+        elif not cv.imwrite(self.pattern % self.count, frame):
+            raise IOError(f"Could not write {self.pattern % self.count}")
+        self.count += 1
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+        elif self._gif is not None:
+            self._gif.close()
+
+
+class StreamingWriter:
+    # encodes frames on a thread fed by a bounded queue: put() blocks while the encoder is max_frames behind
+    def __init__(self, writer, max_frames=EXPORT_QUEUE_FRAMES):
+        self.writer = writer
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_frames)
+        self._thread = threading.Thread(target=self.run, name="FrameWriter", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(frame)
+                except Exception as e:
+                    # keep draining the queue, so the producer is never blocked; it sees the error on its next put
+                    self.error = e
+        try:
+            self.writer.close()
+        except Exception as e:
+            self.error = self.error or e
+
+    def put(self, frame):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def render_frames(recipe, spectra, weights, image=None):
+    # generator of the mixed frames of a recipe along a (frames, N) weight path
+    image = image or Image()
+    mixer = Mixer4images(image)
+    mixer.planes = SpectrumCache()
+    mixer.output_scaling = recipe.scaling
+    mask, flag = None, None
+    if recipe.region:
+        mask = image.half_mask(region_mask(recipe.region, recipe.shape, image))
+        flag = recipe.region.get('inside', True)
+    keys = [(source.path, recipe.shape) for source in recipe.sources]
+    weights_dict, current = {}, [None] * len(keys)
+    for frame_weights in weights:
+        for slot, (source, key) in enumerate(zip(recipe.sources, keys)):
+            # only the images whose weight moved are updated
+            if current[slot] != frame_weights[slot]:
+                mixer.update(weights_dict, source.component, spectra[key], frame_weights[slot], slot, mask, flag,
+                             recipe.shape, key, recipe.mode)
+                current[slot] = frame_weights[slot]
+        yield mixer.compose(weights_dict, recipe.shape, recipe.mode)
+
+
+def export_sweep(recipe, output, keyframes, frames, fps=25, image=None):
+    # renders the recipe along the keyframes to output; returns the number of frames written
+    image = image or Image()
+    spectra, loaded, failures = load_spectra([recipe], image)
+    if failures:
+        raise IOError(failures[0][1])
+    streaming = StreamingWriter(FrameWriter(output, fps, recipe.shape))
+    try:
+        for frame in render_frames(recipe, spectra, weight_path(keyframes, frames), image):
+            streaming.put(frame)
+    finally:
+        streaming.close()
+    return streaming.writer.count
+
+
+def parse_weights(text, count):
+    weights = [float(weight) for weight in text.split(',')]
+    if len(weights) != count:
+        raise ValueError(f"Keyframe {text} has {len(weights)} weights for {count} images")
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the mix of a recipe along a path of weights.")
+    parser.add_argument('recipe', help="recipe JSON file (see cli.py); its output path is ignored")
+    parser.add_argument('output', help="video (.mp4, .avi, ...), .gif, directory or %%d pattern of images")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--sweep', type=int, help="index of the image whose weight goes from 0 to 100%%")
+    group.add_argument('--keyframes', nargs='+', help="comma-separated weights of all images per keyframe")
+    parser.add_argument('--frames', type=int, default=101, help="number of frames (default: 101)")
+    parser.add_argument('--fps', type=float, default=25, help="frame rate of videos and GIFs")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.recipe) as recipe_file:
+            data = json.load(recipe_file)
+        if not isinstance(data, dict):
+            raise ValueError(f"{args.recipe} must hold a single recipe")
+        data['output'] = args.output
+        recipe = Recipe.from_dict(data, os.path.dirname(os.path.abspath(args.recipe)), args.recipe)
+        recipe.output = args.output
+        weights = [source.weight for source in recipe.sources]
+        if args.sweep is not None:
+            if not 0 <= args.sweep < len(weights):
+                raise ValueError(f"--sweep {args.sweep}: the recipe has {len(weights)} images")
+            keyframes = sweep_keyframes(weights, args.sweep)
+        else:
+            keyframes = [parse_weights(keyframe, len(weights)) for keyframe in args.keyframes]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid export: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    try:
+        count = export_sweep(recipe, args.output, keyframes, args.frames, args.fps)
+    except (OSError, RuntimeError) as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    print(f"Wrote {count} frames to {args.output} in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
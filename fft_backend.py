@@ -0,0 +1,148 @@
+import os
+import pickle
+import logging
+
+import numpy as np
+
+my_logger = logging.getLogger("name")
+
+# Which FFT implementation to use: "auto", "scipy", "pyfftw" or "numpy".
+# "auto" picks the first one that is installed, in that order.
+FFT_BACKEND = os.environ.get("MIXER_FFT_BACKEND", "auto")
+# number of threads a single 2D transform may use (ignored by the numpy backend)
+FFT_WORKERS = int(os.environ.get("MIXER_FFT_WORKERS", os.cpu_count() or 1))
+# file where pyFFTW keeps its accumulated wisdom (plans) between runs
+FFTW_WISDOM = os.environ.get("MIXER_FFTW_WISDOM", os.path.join(os.path.expanduser("~"), ".mixer_fftw_wisdom"))
+
+
+# Single-threaded numpy.fft; always available and the fallback for the other backends.
+class NumpyBackend:
+    name = "numpy"
+
+    def __init__(self, workers=1):
+        self.workers = 1
+
+    def describe(self):
+        return f"{self.name} ({self.workers} worker{'s' if self.workers != 1 else ''})"
+
+    def fft2(self, a):
+        return np.fft.fft2(a)
+
+    def ifft2(self, a):
+        return np.fft.ifft2(a)
+
+    def rfft2(self, a):
+        return np.fft.rfft2(a)
+
+    def irfft2(self, a, s=None):
+        return np.fft.irfft2(a, s=s)
+
+    def shutdown(self):
+        pass
+
+
+# scipy.fft, which splits a 2D transform across `workers` threads.
+class ScipyBackend(NumpyBackend):
+    name = "scipy"
+
+    def __init__(self, workers=FFT_WORKERS):
+        import scipy.fft
+        self._fft = scipy.fft
+        self.workers = max(1, workers)
+
+    def fft2(self, a):
+        return self._fft.fft2(a, workers=self.workers)
+
+    def ifft2(self, a):
+        return self._fft.ifft2(a, workers=self.workers)
+
+    def rfft2(self, a):
+        return self._fft.rfft2(a, workers=self.workers)
+
+    def irfft2(self, a, s=None):
+        return self._fft.irfft2(a, s=s, workers=self.workers)
+
+
+# pyFFTW through its numpy-compatible interface. Plans are cached in memory for repeated shapes and
+# the FFTW wisdom is loaded at start-up and saved on shutdown, so planning is only paid once per shape.
+class PyFFTWBackend(NumpyBackend):
+    name = "pyfftw"
+
+    def __init__(self, workers=FFT_WORKERS, wisdom_path=FFTW_WISDOM):
+        import pyfftw
+        import pyfftw.interfaces.numpy_fft
+        self._pyfftw = pyfftw
+        self._fft = pyfftw.interfaces.numpy_fft
+        self.workers = max(1, workers)
+        self.wisdom_path = wisdom_path
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(60)
+        self.load_wisdom()
+
+    def load_wisdom(self):
+        if self.wisdom_path and os.path.exists(self.wisdom_path):
+            try:
+                with open(self.wisdom_path, 'rb') as wisdom_file:
+                    self._pyfftw.import_wisdom(pickle.load(wisdom_file))
+            except (OSError, ValueError, pickle.UnpicklingError) as e:
+                my_logger.warning(f"Could not load FFTW wisdom from {self.wisdom_path}: {e}")
+
+    def save_wisdom(self):
+        if self.wisdom_path:
+            try:
+                with open(self.wisdom_path, 'wb') as wisdom_file:
+                    pickle.dump(self._pyfftw.export_wisdom(), wisdom_file)
+            except OSError as e:
+                my_logger.warning(f"Could not save FFTW wisdom to {self.wisdom_path}: {e}")
+
+    def fft2(self, a):
+        return self._fft.fft2(a, threads=self.workers, planner_effort='FFTW_MEASURE')
+
+    def ifft2(self, a):
+        return self._fft.ifft2(a, threads=self.workers, planner_effort='FFTW_MEASURE')
+
+    def rfft2(self, a):
+        return self._fft.rfft2(a, threads=self.workers, planner_effort='FFTW_MEASURE')
+
+    def irfft2(self, a, s=None):
+        return self._fft.irfft2(a, s=s, threads=self.workers, planner_effort='FFTW_MEASURE')
+
+    def shutdown(self):
+        self.save_wisdom()
+
+
+BACKENDS = {
+    'numpy': NumpyBackend,
+    'scipy': ScipyBackend,
+    'pyfftw': PyFFTWBackend,
+}
+
+
+def create_backend(name=FFT_BACKEND, workers=FFT_WORKERS):
+    # try the requested backend (or every backend for "auto") and fall back to numpy
+    if name == 'auto':
+        candidates = ['scipy', 'pyfftw']
+    elif name in BACKENDS:
+        candidates = [name]
+    else:
+        my_logger.warning(f"Unknown FFT backend '{name}', falling back to numpy")
+        candidates = []
+
+    for candidate in candidates:
+        try:
+            return BACKENDS[candidate](workers)
+        except ImportError:
+            if name != 'auto':
+                my_logger.warning(f"FFT backend '{candidate}' is not installed, falling back to numpy")
+    return NumpyBackend()
+
+
+_backend = None
+
+
+def get_backend():
+    # process-wide backend, created on first use
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
@@ -1,41 +1,409 @@
+import os
+import re
 import numpy as np
 import cv2 as cv
-from main import MainWindow
-import matplotlib.pyplot as plt
+import fft_backend
+import kernels
+from cache import LRUCache, CONTRIBUTION_CACHE_MB
+from instrument import instrumentation
+from shapes import ShapeNormalizer
 import logging
 
+# engine mode: images are real, so the transforms can keep only the non-redundant half of the spectrum
+# (rfft2/irfft2); set MIXER_REAL_FFT=1 to enable it
+REAL_FFT = os.environ.get("MIXER_REAL_FFT", "0") == "1"
+# opt-in single precision: spectra, components and mixing buffers in complex64/float32 instead of
+# complex128/float64 (half the memory and memory traffic); set MIXER_SINGLE_PRECISION=1 to enable it.
+# `python benchmark.py --accuracy` compares its outputs with the double precision path.
+SINGLE_PRECISION = os.environ.get("MIXER_SINGLE_PRECISION", "0") == "1"
+# largest side an image is decoded at; larger files are decoded at a reduced scale (1/2, 1/4 or 1/8) so huge
+# scans never exist at full size in memory. 0 (the default) keeps the full resolution
+MAX_LOAD_SIZE = int(os.environ.get("MIXER_MAX_LOAD_SIZE", "0"))
+# largest side of the image shown in an input view; bigger images are shown from their preview pyramid
+THUMBNAIL_SIZE = int(os.environ.get("MIXER_THUMBNAIL_SIZE", "2048"))
+# OpenCV flags decoding straight to grayscale at 1/1, 1/2, 1/4 and 1/8 of the size
+REDUCED_GRAYSCALE = {1: cv.IMREAD_GRAYSCALE, 2: cv.IMREAD_REDUCED_GRAYSCALE_2, 4: cv.IMREAD_REDUCED_GRAYSCALE_4,
+                     8: cv.IMREAD_REDUCED_GRAYSCALE_8}
+# raw 8 bit grayscale files carry their size in the name: scan.<width>x<height>.raw
+RAW_NAME = re.compile(r"\.(\d+)x(\d+)\.raw$", re.IGNORECASE)
+# number of memoized region masks per Image
+MAX_REGIONS = 256
+# largest side of the preview that is mixed while a slider or a region is being dragged
+PREVIEW_SIZE = int(os.environ.get("MIXER_PREVIEW_SIZE", "512"))
+# set MIXER_PROGRESSIVE=0 to always mix at full resolution
+PROGRESSIVE = os.environ.get("MIXER_PROGRESSIVE", "1") == "1"
+
 
 class Image:
-    def __init__(self):
+    def __init__(self, real_fft=None, single_precision=None):
         self.imageData = None
         self.dataType = None
         self.imageShape = None
         self.view_images = {}
+        self.pyramids = {}  # view -> preview pyramid of its image, largest level first
+        self.real_fft = REAL_FFT if real_fft is None else real_fft
+        self.single_precision = SINGLE_PRECISION if single_precision is None else single_precision
+        # dtypes of spatial / spectral data for the chosen precision
+        self.real_dtype = np.float32 if self.single_precision else np.float64
+        self.complex_dtype = np.complex64 if self.single_precision else np.complex128
+        self.normalizer = ShapeNormalizer()
+        self.regions = {}  # memoized Region and FrequencyMask objects
+        self.radial_grids = {}  # (shape, layout) -> distance of every coefficient from DC
+        # FFT implementation shared by the forward and inverse transforms (see fft_backend.py)
+        self.fft = fft_backend.get_backend()
+
+    @instrumentation.timed("load")
+    def read_grayscale(self, path, reduce=None):
+        # 2-D uint8 image. .npy, raw and (uncompressed, with tifffile installed) TIFF files are memory-mapped,
+        # other formats are decoded straight to grayscale, at 1/reduce of the size (reduce: 1, 2, 4 or 8;
+        # None picks it from MAX_LOAD_SIZE)
+        image = self.map_image(path)
+        if image is not None:
+            reduce = reduce or self.reduce_factor(image.shape)
+            return image if reduce == 1 else np.ascontiguousarray(image[::reduce, ::reduce])
+        if reduce is None:
+            reduce = 1
+            if MAX_LOAD_SIZE:
+                # the size is not known before decoding: probe it with the cheapest (1/8) decode
+                probe = cv.imread(path, REDUCED_GRAYSCALE[8])
+                if probe is None:
+                    raise IOError(f"Could not read image: {path}")
+                reduce = self.reduce_factor((probe.shape[0] * 8, probe.shape[1] * 8))
+                if reduce == 8:
+                    return probe
+        image = cv.imread(path, REDUCED_GRAYSCALE[reduce])
+        if image is None:
+            raise IOError(f"Could not read image: {path}")
+        return image
+
+    def reduce_factor(self, shape, max_size=None):
+        # smallest of 1, 2, 4, 8 that brings the image within max_size (8 if none does)
+        max_size = MAX_LOAD_SIZE if max_size is None else max_size
+        for reduce in (1, 2, 4):
+            if not max_size or max(-(-shape[0] // reduce), -(-shape[1] // reduce)) <= max_size:
+                return reduce
+        return 8
+
+    def map_image(self, path):
+        # read-only memory map of an uncompressed grayscale file, or None for formats that have to be decoded
+        name = path.lower()
+        try:
+            if name.endswith('.npy'):
+                image = np.load(path, mmap_mode='r')
+            elif RAW_NAME.search(name):
+                width, height = (int(size) for size in RAW_NAME.search(name).groups())
+                image = np.memmap(path, dtype=np.uint8, mode='r', shape=(height, width))
+            elif name.endswith(('.tif', '.tiff')):
+                try:
+                    import tifffile
+                except ImportError:
+                    return None
+                try:
+                    image = tifffile.memmap(path, mode='r')
+                except ValueError:
+                    # compressed or tiled: decoded by OpenCV instead
+                    return None
+                if image.ndim != 2 or image.dtype != np.uint8:
+                    # colour or 16 bit: OpenCV converts it while decoding
+                    return None
+            else:
+                return None
+        except (OSError, ValueError) as e:
+            raise IOError(f"Could not read image: {path} ({e})")
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise IOError(f"Could not read image: {path} (memory-mapped images must be 2-D uint8)")
+        return image
+
+    def preview_pyramid(self, image, max_size=THUMBNAIL_SIZE):
+        # halved copies of an image (pyrDown), largest first, down to the first one within max_size; an image
+        # that already fits is its own (single level) pyramid. A mapped image is first decimated by striding,
+        # which only reads the rows it needs, so a thumbnail never materializes the whole file
+        if max(image.shape) <= max_size:
+            return [image]
+        step = 1
+        while max(image.shape) // (step * 2) > 2 * max_size:
+            step *= 2
+        levels = [image if step == 1 else np.ascontiguousarray(image[::step, ::step])]
+        while max(levels[-1].shape) > max_size:
+            levels.append(cv.pyrDown(levels[-1]))
+        return levels
+
+    def thumbnail(self, view):
+        # smallest preview of the image loaded in a view, for display
+        return self.pyramids[view][-1]
 
     def load_image(self, path, view):
-        self.imageData = cv.imread(path)
-        self.imageData = cv.cvtColor(self.imageData, cv.COLOR_RGB2GRAY)
+        self.imageData = self.read_grayscale(path)
         self.dataType = self.imageData.dtype
         self.imageShape = self.imageData.shape
         # print("the image loaded shape is ", self.imageShape)
         # save copies of the image data relative to the view it was loaded in
+        self.normalizer.invalidate(view)
         self.view_images[view] = self.imageData
         # print(self.imageData)
-        if self.view_images is not None:
-            # (print("sara"))
-            min_height, min_width = min(img.shape[0] for img in self.view_images.values()), min(
-                img.shape[1] for img in self.view_images.values())
-            self.imageData = cv.resize(self.imageData, (min_width, min_height))
+        # all images are mixed at one common shape (see shapes.py)
+        self.imageData = self.normalized(view)
+        self.pyramids[view] = self.preview_pyramid(self.imageData)
+
+    def target_shape(self):
+        # common shape of the loaded images
+        return self.normalizer.target_shape(img.shape for img in self.view_images.values())
 
+    def normalized(self, view, target=None):
+        # image loaded in a view, fitted to the common shape (or target); cached per target shape
+        return self.normalizer.normalize(view, self.view_images[view], target or self.target_shape())
+
+    @instrumentation.timed("fft")
     def fourier_transform(self, img):
-        img_fourier = np.fft.fft2(img)
+        # the input precision decides the output precision of the FFT backends (float32 -> complex64)
+        img = np.asarray(img, dtype=self.real_dtype)
+        if self.real_fft:
+            # unshifted half spectrum (H, W // 2 + 1); the other half is its complex-conjugate mirror
+            return self.fft.rfft2(img).astype(self.complex_dtype, copy=False)
+        img_fourier = self.fft.fft2(img).astype(self.complex_dtype, copy=False)
         img_fourier_shifted = np.fft.fftshift(img_fourier)
         return img_fourier_shifted
 
-    def inverseFourier(self, weighted_img_ft):
-        img_inverse_fourier = np.real(np.fft.ifft2(weighted_img_ft))
+    @instrumentation.timed("ifft")
+    def inverseFourier(self, weighted_img_ft, shape=None):
+        # shape is the spatial (height, width) of the image, needed to invert an odd-width half spectrum
+        if self.real_fft:
+            return self.fft.irfft2(weighted_img_ft, s=shape)
+        img_inverse_fourier = np.real(self.fft.ifft2(weighted_img_ft))
         return img_inverse_fourier
 
+    def full_spectrum(self, img_fourier, shape):
+        # full shifted spectrum of an image, as shown in the FT views and used for region selection
+        if not self.real_fft:
+            return img_fourier
+        height, width = shape
+        half_width = img_fourier.shape[1]
+        full = np.empty(shape, dtype=img_fourier.dtype)
+        full[:, :half_width] = img_fourier
+        # Hermitian symmetry of real input: X[-u, -v] = conj(X[u, v])
+        rows = -np.arange(height) % height
+        cols = -np.arange(half_width, width) % width
+        full[:, half_width:] = np.conj(img_fourier[np.ix_(rows, cols)])
+        return np.fft.fftshift(full)
+
+    def rect_region(self, shape, x, y, width, height):
+        # region of the centred spectrum covered by a rectangle; memoized, so the same rectangle is shared by
+        # all images (and all updates) of that shape
+        key = (tuple(shape), x, y, width, height)
+        region = self.regions.get(key)
+        if region is None:
+            if len(self.regions) >= MAX_REGIONS:
+                self.regions.clear()
+            rows = (min(max(y, 0), shape[0]), min(max(y + height, 0), shape[0]))
+            cols = (min(max(x, 0), shape[1]), min(max(x + width, 0), shape[1]))
+            region = self.regions[key] = Region(shape, [(rows, cols)])
+        return region
+
+    def half_mask(self, mask):
+        # map a region drawn on the full shifted spectrum onto the half-spectrum layout: a Region when it is
+        # point-symmetric about DC, else a HalfRegion that also covers its mirror (the inverse transform only sees
+        # the Hermitian part of a half spectrum)
+        if not self.real_fft or not isinstance(mask, Region):
+            # frequency masks are built in the spectra's own layout
+            return mask
+        key = ('half',) + mask.key
+        half = self.regions.get(key)
+        if half is None:
+            if len(self.regions) >= MAX_REGIONS:
+                self.regions.clear()
+            mirror = self.mirrored_region(mask)
+            if sorted(mirror.blocks) == sorted(mask.blocks):
+                half = self.half_region(mask)
+            else:
+                half = HalfRegion(self.half_region(mask), self.half_region(mirror))
+            self.regions[key] = half
+        return half
+
+    def half_region(self, mask):
+        # the blocks of a region of the centred spectrum that lie on the unshifted half spectrum
+        height, width = mask.shape
+        half_width = width // 2 + 1
+        blocks = []
+        for (row_start, row_stop), (col_start, col_stop) in mask.blocks:
+            for rows in self.unshifted_ranges(row_start, row_stop, height):
+                for cols in self.unshifted_ranges(col_start, col_stop, width):
+                    cols = (cols[0], min(cols[1], half_width))
+                    if cols[0] < cols[1]:
+                        blocks.append((rows, cols))
+        return Region((height, half_width), blocks)
+
+    def mirrored_region(self, mask):
+        # region of the centred spectrum holding the frequencies opposite (about DC) to those of mask
+        height, width = mask.shape
+        blocks = [(rows, cols) for (row_start, row_stop), (col_start, col_stop) in mask.blocks
+                  for rows in self.mirrored_ranges(row_start, row_stop, height)
+                  for cols in self.mirrored_ranges(col_start, col_stop, width)]
+        return Region(mask.shape, blocks)
+
+    @staticmethod
+    def mirrored_ranges(start, stop, n):
+        # centred indices of the frequencies opposite to those of [start, stop): index i holds frequency i - n // 2,
+        # whose opposite is at 2 * (n // 2) - i; on an even axis the Nyquist frequency (i = 0) is its own opposite
+        if start >= stop:
+            return []
+        start, stop = 2 * (n // 2) - stop + 1, 2 * (n // 2) - start + 1
+        ranges = [(start, min(stop, n))] if start < n else []
+        if stop > n:
+            ranges.append((0, stop - n))
+        return ranges
+
+    def radial_grid(self, shape):
+        # distance of every coefficient of a spectrum of the spatial shape from DC, in the spectra's layout
+        # (centred, or unshifted half spectrum), as a fraction of the Nyquist frequency along each axis;
+        # computed once per shape
+        key = (tuple(shape), self.real_fft)
+        grid = self.radial_grids.get(key)
+        if grid is None:
+            height, width = shape
+            rows = 2 * np.fft.fftfreq(height)
+            if self.real_fft:
+                cols = 2 * np.fft.rfftfreq(width)
+            else:
+                rows, cols = np.fft.fftshift(rows), np.fft.fftshift(2 * np.fft.fftfreq(width))
+            grid = np.hypot(rows[:, None], cols[None, :]).astype(self.real_dtype)
+            grid.flags.writeable = False
+            self.radial_grids[key] = grid
+        return grid
+
+    def frequency_mask(self, kind, shape, cutoff=0.5, low=0.0, high=1.0, order=2):
+        # FrequencyMask of a spectrum of the spatial shape; radii are fractions of the Nyquist frequency:
+        #   lowpass / highpass    keep the frequencies within / beyond cutoff
+        #   bandpass              keep the ring low <= r <= high
+        #   gaussian              exp(-r^2 / (2 cutoff^2)), a soft low-pass
+        #   butterworth           1 / (1 + (r / cutoff)^(2 order)), a soft low-pass
+        # the outside of any of them (apply(..., inside=False)) is the complementary filter, e.g. a Gaussian
+        # high-pass. Memoized per parameter set: a new radius only thresholds or evaluates the cached grid
+        if kind in ('lowpass', 'highpass', 'gaussian'):
+            params = (cutoff,)
+        elif kind == 'bandpass':
+            params = (low, high)
+        elif kind == 'butterworth':
+            params = (cutoff, order)
+        else:
+            raise ValueError(f"Unknown frequency mask: {kind}")
+        key = ('frequency', kind, params, tuple(shape), self.real_fft)
+        mask = self.regions.get(key)
+        if mask is None:
+            if len(self.regions) >= MAX_REGIONS:
+                self.regions.clear()
+            radius = self.radial_grid(shape)
+            if kind == 'lowpass':
+                weights = radius <= cutoff
+            elif kind == 'highpass':
+                weights = radius > cutoff
+            elif kind == 'bandpass':
+                weights = (radius >= low) & (radius <= high)
+            elif kind == 'gaussian':
+                weights = np.exp(-np.square(radius) / (2 * max(cutoff, 1e-6) ** 2))
+            else:
+                weights = 1 / (1 + (radius / max(cutoff, 1e-6)) ** (2 * order))
+            mask = self.regions[key] = FrequencyMask(key, weights)
+        return mask
+
+    @staticmethod
+    def unshifted_ranges(start, stop, n):
+        # [start, stop) on a centred axis of length n as ranges of the unshifted axis (ifftshift moves i to i - n // 2)
+        start, stop = start - n // 2, stop - n // 2
+        if start >= stop:
+            return []
+        if start >= 0:
+            return [(start, stop)]
+        if stop <= 0:
+            return [(start + n, stop + n)]
+        return [(start + n, n), (0, stop)]
+
+    def pyramid_level(self, shape, max_size=PREVIEW_SIZE):
+        # number of halvings of the image until both sides fit in max_size (0: use the full resolution)
+        level = 0
+        while max(self.level_shape(shape, level)) > max_size:
+            level += 1
+        return level
+
+    def level_shape(self, shape, level):
+        return -(-shape[0] // 2 ** level), -(-shape[1] // 2 ** level)
+
+    def downsample_spectrum(self, img_fourier, shape, level):
+        # spectrum of the image at a pyramid level: keeping only the lowest frequencies of the full spectrum
+        # (scaled for the smaller inverse transform) is the low-passed, downsampled image, without a new FFT
+        if level == 0:
+            return img_fourier
+        height, width = self.level_shape(shape, level)
+        scale = (height * width) / (shape[0] * shape[1])
+        if self.real_fft:
+            # unshifted half spectrum: low positive and negative row frequencies, low column frequencies
+            rows = np.r_[0:(height + 1) // 2, shape[0] - height // 2:shape[0]]
+            return img_fourier[rows, :width // 2 + 1] * scale
+        top = shape[0] // 2 - height // 2
+        left = shape[1] // 2 - width // 2
+        return img_fourier[top:top + height, left:left + width] * scale
+
+    def level_windows(self, shape, level):
+        # the parts of the spectrum of the spatial shape that downsample_spectrum keeps at a pyramid level, per
+        # axis: (start, stop, position in the downsampled spectrum) ranges of the rows and of the columns
+        height, width = self.level_shape(shape, level)
+        if self.real_fft:
+            rows = [(0, (height + 1) // 2, 0), (shape[0] - height // 2, shape[0], (height + 1) // 2)]
+            return rows, [(0, width // 2 + 1, 0)]
+        top = shape[0] // 2 - height // 2
+        left = shape[1] // 2 - width // 2
+        return [(top, top + height, 0)], [(left, left + width, 0)]
+
+    def downsample_mask(self, mask, shape, level):
+        # mask (in the spectra's layout, see half_mask) of the spectrum of the spatial shape, restricted to the
+        # frequencies downsample_spectrum keeps: a preview then masks the same frequencies as the full resolution mix
+        if level == 0 or mask is None:
+            return mask
+        if isinstance(mask, HalfRegion):
+            return HalfRegion(self.downsample_mask(mask.region, shape, level),
+                              self.downsample_mask(mask.mirror, shape, level))
+        key = ('level', tuple(shape), level) + mask.key
+        downsampled = self.regions.get(key)
+        if downsampled is None:
+            if len(self.regions) >= MAX_REGIONS:
+                self.regions.clear()
+            row_windows, col_windows = self.level_windows(shape, level)
+            if isinstance(mask, FrequencyMask):
+                rows = np.concatenate([np.arange(start, stop) for start, stop, _ in row_windows])
+                cols = np.concatenate([np.arange(start, stop) for start, stop, _ in col_windows])
+                downsampled = FrequencyMask(key, mask.weights[np.ix_(rows, cols)])
+            else:
+                level_shape = (sum(stop - start for start, stop, _ in row_windows),
+                               sum(stop - start for start, stop, _ in col_windows))
+                blocks = [(self.window_range(rows, row_window), self.window_range(cols, col_window))
+                          for rows, cols in mask.blocks for row_window in row_windows for col_window in col_windows]
+                downsampled = Region(level_shape, [(rows, cols) for rows, cols in blocks
+                                                   if rows[0] < rows[1] and cols[0] < cols[1]])
+            self.regions[key] = downsampled
+        return downsampled
+
+    @staticmethod
+    def window_range(indices, window):
+        # the part of the range [start, stop) inside a window of level_windows, in downsampled indices
+        (start, stop), (window_start, window_stop, position) = indices, window
+        return (max(start, window_start) - window_start + position,
+                min(stop, window_stop) - window_start + position)
+
+    @instrumentation.timed("normalize")
+    def to_uint8(self, img, scaling="clip"):
+        # output stage: map the (real) inverse transform to a contiguous 8-bit grayscale buffer
+        if scaling == "clip":
+            # saturate to the displayable range, the same way cv.imwrite converts floating point images
+            out = np.clip(img, 0, 255)
+        elif scaling == "normalize":
+            # stretch the full range of the result onto 0..255
+            low, high = np.min(img), np.max(img)
+            scale = 255.0 / (high - low) if high > low else 0.0
+            out = (img - low) * scale
+        else:
+            raise ValueError(f"Unknown output scaling: {scaling}")
+        np.rint(out, out=out)
+        return np.ascontiguousarray(out, dtype=np.uint8)
+
     def realComponent(self, img_fourier):
         return np.real(img_fourier)
 
@@ -48,8 +416,126 @@ class Image:
     def phase(self, img_fourier):
         return np.angle(img_fourier)
 
+    def unit_phasor(self, img_fourier):
+        # exp(1j * phase) without the angle/exp round trip; 1 where the spectrum is 0 (phase 0)
+        magnitude = np.abs(img_fourier)
+        phasor = np.divide(img_fourier, magnitude, out=np.ones_like(img_fourier), where=magnitude != 0)
+        return phasor
+
+    def component(self, name, img_fourier):
+        component_methods = {
+            'Real': self.realComponent,
+            'Imaginary': self.imaginaryComponent,
+            'Magnitude': self.magnitude,
+            'Phase': self.phase,
+            'Phasor': self.unit_phasor,
+        }
+        return component_methods[name](img_fourier)
+
+    def brightness_contrast_lut(self, alpha, beta):
+        # the 256 possible results of convertScaleAbs (saturate(|alpha * x + beta|)), one per gray level
+        return cv.convertScaleAbs(np.arange(256, dtype=np.uint8).reshape(1, 256), alpha=alpha, beta=beta)
+
     def adjust_brightness_contrast(self, alpha, beta):
-        return cv.convertScaleAbs(self.imageData, alpha=alpha, beta=beta)
+        # one table lookup per pixel instead of the float arithmetic of convertScaleAbs; same result
+        return cv.LUT(self.imageData, self.brightness_contrast_lut(alpha, beta))
+
+    def affine_sign(self, alpha, beta, low, high):
+        # convertScaleAbs of gray levels in [low, high] is sign * (alpha * x + beta) (up to rounding) as long as
+        # nothing is saturated or folded by the absolute value; returns that sign, or None when it is not affine
+        ends = (alpha * low + beta, alpha * high + beta)
+        if all(0 <= value <= 255 for value in ends):
+            return 1
+        if all(-255 <= value <= 0 for value in ends):
+            return -1
+        return None
+
+    def adjust_spectrum(self, img_fourier, shape, alpha, beta):
+        # spectrum of alpha * image + beta from the spectrum of the image: the scaling is linear and the offset
+        # only adds beta * H * W to the DC coefficient, so no new FFT is needed
+        adjusted = np.multiply(img_fourier, alpha)
+        dc = (0, 0) if self.real_fft else (shape[0] // 2, shape[1] // 2)
+        adjusted[dc] += beta * shape[0] * shape[1]
+        return adjusted
+
+
+# Rectangular region of a spectrum, used as a mask. It is stored as the rectangular blocks it covers in the
+# spectrum's own layout (one block on the centred spectrum, up to four once mapped to the unshifted half
+# spectrum), so keeping the inside or the outside of it is done by slicing instead of multiplying by a
+# full-size boolean mask or its inverted copy.
+class Region:
+    def __init__(self, shape, blocks):
+        self.shape = tuple(shape)
+        self.blocks = tuple((tuple(rows), tuple(cols)) for rows, cols in blocks)
+        self.key = ('rect', self.shape, self.blocks)
+
+    def apply(self, component, inside=True, out=None):
+        # copy of component with everything outside (inside=True) or inside (inside=False) the region zeroed,
+        # written into out when it is a matching buffer
+        if out is None or out.shape != component.shape or out.dtype != component.dtype:
+            out = np.empty(component.shape, dtype=component.dtype)
+        if inside:
+            if out is component:
+                # in place: keep copies of the blocks only, not of the whole array
+                kept = [component[row_start:row_stop, col_start:col_stop].copy()
+                        for (row_start, row_stop), (col_start, col_stop) in self.blocks]
+            else:
+                kept = [component[row_start:row_stop, col_start:col_stop]
+                        for (row_start, row_stop), (col_start, col_stop) in self.blocks]
+            out.fill(0)
+            for ((row_start, row_stop), (col_start, col_stop)), block in zip(self.blocks, kept):
+                out[row_start:row_stop, col_start:col_stop] = block
+        else:
+            if out is not component:
+                np.copyto(out, component)
+            for (row_start, row_stop), (col_start, col_stop) in self.blocks:
+                out[row_start:row_stop, col_start:col_stop] = 0
+        return out
+
+
+# Region of the half spectrum for a rectangle that is not point-symmetric about DC. The inverse real transform
+# only keeps the Hermitian part of a half spectrum, the mean of the spectrum and of its conjugate mirror, so the
+# full-spectrum mix is reproduced with the region (.region) and its mirror about DC (.mirror): real and imaginary
+# parts are linear and apply() weights them by the mean of the two masks, magnitude/phase mixes are recombined
+# once with each side and averaged (see Mixer4images.compose and MixEngine.mix_spectrum).
+class HalfRegion:
+    def __init__(self, region, mirror):
+        self.region = region
+        self.mirror = mirror
+        self.shape = region.shape
+        self.key = ('half', region.key, mirror.key)
+
+    def apply(self, component, inside=True, out=None):
+        # the mirrored side first: out may be component itself
+        mirrored = self.mirror.apply(component, inside)
+        out = self.region.apply(component, inside, out)
+        out += mirrored
+        out *= 0.5
+        return out
+
+
+# Circular, annular or soft (Gaussian, Butterworth) mask of a spectrum, see Image.frequency_mask. Used like a
+# Region: apply() keeps the inside (weights) or the outside (1 - weights) of the mask.
+class FrequencyMask:
+    def __init__(self, key, weights):
+        self.key = key
+        self.shape = weights.shape
+        weights.flags.writeable = False
+        self.weights = weights  # boolean (hard masks) or float (soft masks)
+        self._outside = None
+
+    def outside(self):
+        if self._outside is None:
+            self._outside = ~self.weights if self.weights.dtype == bool else 1 - self.weights
+            self._outside.flags.writeable = False
+        return self._outside
+
+    def apply(self, component, inside=True, out=None):
+        # component weighted by the mask (or its complement), written into out when it is a matching buffer
+        if out is None or out.shape != component.shape or out.dtype != component.dtype:
+            out = None
+        weights = self.weights if inside else self.outside()
+        return np.multiply(component, weights, out=out, dtype=component.dtype)
 
 
 class Modes:
@@ -92,73 +578,229 @@ class Modes:
 
 
 class Mixer4images:
-    def __init__(self):
+    def __init__(self, image=None):
         # self.main = None
         self.chosen_mode = None
         self.weighted_magnitude = []
         self.weighted_phase = []
         self.weighted_real = []
         self.weighted_imaginary = []
-        self.image = Image()
+        self.image = image or Image()
         self.active_region = False
-        # self.main_window = main.MainWindow()
-        # self.main= main
-        self.main_window = MainWindow
+        # how the inverse transform is mapped to 8 bits: "clip" or "normalize"
+        self.output_scaling = "clip"
+        # real/imaginary mode is linear in the weights: the spatial-domain image of every
+        # (image, component, region) is computed once and a weight change is just a weighted sum
+        self.contributions = LRUCache(CONTRIBUTION_CACHE_MB * 1024 * 1024)
+        # optional SpectrumCache holding the component planes of keyed spectra (see SpectrumCache.get_component),
+        # so a weight change only costs the weighted multiply
+        self.planes = None
+        # magnitude/phase mode: combobox -> (weight, key, spectrum) of an unmasked phase, so that a single phase at
+        # 100% can use the cached unit phasor instead of exp(1j * phase)
+        self.phase_sources = {}
+        # complex outputs of the magnitude/phase recombination (the mix, and the mirrored side of half-spectrum
+        # regions), reused by every compose instead of allocated; reallocated only when the shape or precision
+        # changes
+        self.spectrum_buffers = [None, None]
+        # combobox -> (weight, contribution): the terms hold their arrays, the LRU only serves their reuse, so an
+        # eviction (or a contribution larger than the whole budget) can never drop an image from the mix
+        self.spatial_terms = {}
 
-    def mix(self, weights_dict, current_component, image_ft, weight_value, combobox, mask=None, flag=None):
-        # Apply weight to the chosen component for the selected image
-        weighted_component = self.apply_weights(weight_value, current_component, image_ft, mask, flag)
+    def mix(self, weights_dict, current_component, image_ft, weight_value, combobox, mask=None, flag=None, shape=None,
+            key=None, mode=None):
+        # key identifies the image (and its version) behind image_ft, so its spatial contributions can be reused
+        self.update(weights_dict, current_component, image_ft, weight_value, combobox, mask, flag, shape, key, mode)
+        return self.compose(weights_dict, shape, mode)
+
+    def update(self, weights_dict, current_component, image_ft, weight_value, combobox, mask=None, flag=None,
+               shape=None, key=None, mode=None):
+        # store the weighted component of one image; several updates can be followed by a single compose
+        mode = mode or self.chosen_mode
+        # the previous weighted array of this component is overwritten in place instead of reallocated
+        previous = weights_dict.get(combobox, {}).get(current_component)
         # Reset all values for the combobox to 0
         weights_dict[combobox] = {'Real': 0, 'Imaginary': 0, 'Magnitude': 0, 'Phase': 0}
+        if mode == "real_imaginary mode":
+            self.phase_sources.pop(combobox, None)
+            self.update_spatial(current_component, image_ft, weight_value, combobox, mask, flag, shape, key)
+            return
+        self.spatial_terms.pop(combobox, None)
+        if getattr(mask, 'mirror', None) is not None:
+            # asymmetric region on the half spectrum: the mirrored side is mixed too (see HalfRegion)
+            weights_dict[combobox]['Mirror'] = {
+                current_component: self.apply_weights(weight_value, current_component, image_ft, mask.mirror, flag,
+                                                      key=key)}
+            mask = mask.region
+        if current_component == 'Phase' and mask is None and key is not None:
+            self.phase_sources[combobox] = (weight_value, key, image_ft)
+        else:
+            self.phase_sources.pop(combobox, None)
+
+        # Apply weight to the chosen component for the selected image
+        weighted_component = self.apply_weights(weight_value, current_component, image_ft, mask, flag,
+                                                 previous if isinstance(previous, np.ndarray) else None, key)
         # Update the weight in the dictionary
         weights_dict[combobox][current_component] = weighted_component
+
+    def remove(self, weights_dict, combobox):
+        # forget the image of a combobox (its image was unloaded)
+        weights_dict.pop(combobox, None)
+        self.phase_sources.pop(combobox, None)
+        self.spatial_terms.pop(combobox, None)
+
+    @instrumentation.timed("mix")
+    def compose(self, weights_dict, shape=None, mode=None):
+        # inverse transform of the mix of all the stored weighted components
+        mode = mode or self.chosen_mode
         # print("chosen mode1111:", self.chosen_mode)
-        if self.chosen_mode == "magnitude_phase mode":
+        if mode == "magnitude_phase mode":
             self.weighted_magnitude = [info['Magnitude'] for info in weights_dict.values()]
             self.weighted_phase = [info['Phase'] for info in weights_dict.values()]
-            tot_weighted = self.mix_magnitude_phase(self.weighted_magnitude, self.weighted_phase)
-            tot_weighted = np.fft.ifftshift(tot_weighted)  # what we just add to creect what wrong
-        elif self.chosen_mode == "real_imaginary mode":
-            self.weighted_real = [info['Real'] for info in weights_dict.values()]
-            self.weighted_imaginary = [info['Imaginary'] for info in weights_dict.values()]
-            tot_weighted = self.mix_real_imaginary(self.weighted_real, self.weighted_imaginary)
-            tot_weighted = np.fft.ifftshift(tot_weighted)  # what we just add to creect what wrong
+            mirrored = any('Mirror' in info for info in weights_dict.values())
+            phasor = None if mirrored else self.single_phasor(weights_dict)
+            if phasor is not None:
+                magnitude = kernels.accumulate(self.weighted_magnitude)
+                tot_weighted = self.spectrum_buffer(0, phasor)
+                if magnitude is None:
+                    tot_weighted.fill(0)
+                else:
+                    np.multiply(magnitude, phasor, out=tot_weighted)
+            else:
+                tot_weighted = self.mix_magnitude_phase(self.weighted_magnitude, self.weighted_phase)
+            if mirrored:
+                # mean with the mix of the mirrored sides of the regions (see HalfRegion)
+                tot_weighted += self.mix_magnitude_phase(
+                    [info.get('Mirror', {}).get('Magnitude', info['Magnitude']) for info in weights_dict.values()],
+                    [info.get('Mirror', {}).get('Phase', info['Phase']) for info in weights_dict.values()], buffer=1)
+                tot_weighted *= 0.5
+        elif mode == "real_imaginary mode":
+            return self.compose_spatial(shape)
         else:
             return
-        image_after_inverse = self.image.inverseFourier(tot_weighted)
+        if not self.image.real_fft:
+            tot_weighted = np.fft.ifftshift(tot_weighted)  # what we just add to creect what wrong
+        image_after_inverse = self.image.inverseFourier(tot_weighted, shape)
         # print("Type of image_after_inverse:", type(image_after_inverse))
 
         # Check the shape of the NumPy array if it's a 2D array (grayscale image)
         # print("Shape of image_after_inverse:", image_after_inverse.shape)
-        cv.imwrite('test2.jpg', np.real(image_after_inverse))
-        image = cv.imread('test2.jpg', cv.IMREAD_GRAYSCALE)
+        return self.image.to_uint8(image_after_inverse, self.output_scaling)
 
-        return image
+    def single_phasor(self, weights_dict):
+        # cached exp(1j * phase) when the mixed phase is exactly one unmasked phase at 100%, else None
+        if self.planes is None:
+            return None
+        phases = [combobox for combobox, info in weights_dict.items() if isinstance(info['Phase'], np.ndarray)]
+        if len(phases) != 1 or phases[0] not in self.phase_sources:
+            return None
+        weight_value, key, image_ft = self.phase_sources[phases[0]]
+        if weight_value != 100:
+            return None
+        return self.planes.get_component(key, 'Phasor', image_ft, self.image.component)
 
-    def apply_weights(self, weight_value, current_component, image_ft, mask=None, flag=None):
-        component_methods = {
-            'Real': self.image.realComponent,
-            'Imaginary': self.image.imaginaryComponent,
-            'Magnitude': self.image.magnitude,
-            'Phase': self.image.phase
-        }
-        if current_component in component_methods:
-            fourier_component = component_methods[current_component](image_ft)
-            if mask is not None:
-                if flag:
-                    fourier_component *= mask
-                else:
-                    fourier_component *= ~mask
-            weighted_component = (weight_value * fourier_component) / 100
+    def update_spatial(self, current_component, image_ft, weight_value, combobox, mask=None, flag=None, shape=None,
+                       key=None):
+        # fast path of real/imaginary mode: ifft(sum(w_i * C_i)) == sum(w_i * ifft(C_i)), so the output is a
+        # weighted sum of cached spatial-domain contributions and a weight change needs no FFT at all
+        if current_component in ('Real', 'Imaginary'):
+            contribution_key = (key, current_component, self.mask_key(mask, flag))
+            contribution = None if key is None else self.contributions.get(contribution_key)
+            if contribution is None:
+                contribution = self.spatial_contribution(current_component, image_ft, mask, flag, shape, key)
+                # an unknown image (no key) has nothing to reuse its contribution for
+                if key is not None:
+                    self.contributions.put(contribution_key, contribution)
+            self.spatial_terms[combobox] = (weight_value / 100, contribution)
         else:
-            weighted_component = None
+            self.spatial_terms.pop(combobox, None)
 
+    def compose_spatial(self, shape=None):
+        total = self.spatial_sum(shape)
+        if total is None:
+            return
+        return self.image.to_uint8(total, self.output_scaling)
+
+    def spatial_sum(self, shape=None):
+        # weighted sum of the cached spatial contributions, before the 8 bit mapping
+        total = None
+        scratch = None
+        for weight, contribution in list(self.spatial_terms.values()):
+            if total is None:
+                total = np.multiply(contribution, weight)
+                scratch = np.empty_like(total)
+            else:
+                total += np.multiply(contribution, weight, out=scratch)
+        if total is None:
+            if shape is None:
+                return
+            total = np.zeros(shape, dtype=self.image.real_dtype)
+        return total
+
+    def spatial_contribution(self, current_component, image_ft, mask=None, flag=None, shape=None, key=None):
+        # spatial-domain image of one (masked) real or imaginary component at 100% weight
+        fourier_component = self.masked_component(current_component, image_ft, mask, flag, key=key)
+        if current_component == 'Imaginary':
+            fourier_component = 1j * fourier_component
+        if not self.image.real_fft:
+            fourier_component = np.fft.ifftshift(fourier_component)
+        return self.image.inverseFourier(fourier_component, shape)
+
+    def mask_key(self, mask, flag):
+        # identity of a region mask (and which side of it is kept) for the contribution cache
+        if mask is None:
+            return None
+        return bool(flag), mask.key
+
+    def invalidate_image(self, image_id, keep=None):
+        # drop the spatial contributions of every version of an image but keep
+        # (keys are ((image_id, version), ...))
+        self.contributions.invalidate(lambda key: isinstance(key[0], tuple) and key[0][0] == image_id
+                                      and key[0][1] != keep)
+
+    @instrumentation.timed("component")
+    def masked_component(self, current_component, image_ft, mask=None, flag=None, out=None, key=None):
+        # mask is a Region; out is an optional buffer the masked component is written into;
+        # key identifies the spectrum, so its component plane can be taken from (and kept in) self.planes
+        if current_component not in ('Real', 'Imaginary', 'Magnitude', 'Phase'):
+            return None
+        if key is not None and self.planes is not None:
+            fourier_component = self.planes.get_component(key, current_component, image_ft, self.image.component)
+        else:
+            fourier_component = self.image.component(current_component, image_ft)
+        if mask is not None:
+            with instrumentation.stage("mask"):
+                # never in place: np.real/np.imag return views into the (cached) spectrum and planes are shared
+                fourier_component = mask.apply(fourier_component, flag, out)
+        return fourier_component
+
+    def apply_weights(self, weight_value, current_component, image_ft, mask=None, flag=None, out=None, key=None):
+        # out: optional buffer (e.g. the previous weighted array) the result is written into
+        fourier_component = self.masked_component(current_component, image_ft, mask, flag, out, key)
+        if fourier_component is None:
+            return None
+        if out is None or out.shape != fourier_component.shape or out.dtype != fourier_component.dtype:
+            out = None
+        weighted_component = np.multiply(fourier_component, weight_value / 100, out=out)
         return weighted_component
 
-    def mix_magnitude_phase(self, weighted_magnitude, weighted_phase):
-        magnitude = sum(weighted_magnitude)
-        phase = sum(weighted_phase)
-        return magnitude * np.exp(1j * phase)
+    def spectrum_buffer(self, index, like):
+        # persistent complex output buffer index, matching the shape and dtype of like
+        buffer = self.spectrum_buffers[index]
+        if buffer is None or buffer.shape != like.shape or buffer.dtype != like.dtype:
+            buffer = self.spectrum_buffers[index] = np.empty(like.shape, dtype=like.dtype)
+        return buffer
+
+    def mix_magnitude_phase(self, weighted_magnitude, weighted_phase, buffer=0):
+        # sums accumulated in one buffer each, recombined by the fused kernel (see kernels.py) into the persistent
+        # output buffer (see spectrum_buffers), so the result is only valid until the next recombination
+        magnitude = kernels.accumulate(weighted_magnitude)
+        phase = kernels.accumulate(weighted_phase)
+        if magnitude is None and phase is None:
+            return sum(weighted_magnitude) * np.exp(1j * sum(weighted_phase))
+        out = kernels.recombine(0 if magnitude is None else magnitude, 0 if phase is None else phase,
+                                self.spectrum_buffers[buffer])
+        self.spectrum_buffers[buffer] = out
+        return out
 
     def mix_real_imaginary(self, weighted_real, weighted_imaginary):
         real = sum(weighted_real)
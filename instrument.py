@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+import cProfile
+import pstats
+import contextlib
+from collections import deque
+
+import numpy as np
+
+# Per-stage latency instrumentation of the mixing pipeline.
+#
+#     with instrumentation.stage("fft"):
+#         ...
+#
+# When disabled (the default) a stage costs one attribute check. When enabled, every call's duration goes into
+# a rolling window per stage (summary() reports count/mean/percentiles and a log2 histogram) and into a trace
+# that dump_trace() writes in the Chrome trace-event format (chrome://tracing, Perfetto, speedscope).
+# start_profiler()/stop_profiler() additionally run cProfile and write a .prof file for pstats/snakeviz. cProfile
+# only sees the thread it is enabled in, so the worker threads (mixing, image import) wrap each unit of work in
+# thread_profile(), which profiles it with a profiler of their own; stop_profiler() merges them all into the dump.
+# Set MIXER_PROFILE=1 to enable it at start-up; MIXER_PROFILE_DIR is where dumps are written.
+
+PROFILE = os.environ.get("MIXER_PROFILE", "0") == "1"
+PROFILE_DIR = os.environ.get("MIXER_PROFILE_DIR", ".")
+HISTORY = 512  # durations kept per stage
+TRACE_EVENTS = 20000  # trace events kept in total
+
+
+class Instrumentation:
+    def __init__(self, enabled=PROFILE, history=HISTORY, trace_events=TRACE_EVENTS):
+        self.enabled = enabled
+        self.history = history
+        self.durations = {}  # stage -> deque of seconds
+        self.events = deque(maxlen=trace_events)  # (stage, start, duration, thread id)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._thread_profilers = {}  # thread id -> cProfile of a worker thread (see thread_profile)
+        self._profiling_threads = set()  # ids of the worker threads inside thread_profile
+        self._null = contextlib.nullcontext()
+
+    def stage(self, name):
+        if not self.enabled:
+            return self._null
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def timed(self, name):
+        # decorator form of stage()
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._timer(name):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    def record(self, name, start, duration):
+        with self._lock:
+            window = self.durations.get(name)
+            if window is None:
+                window = self.durations[name] = deque(maxlen=self.history)
+            window.append(duration)
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+            self.events.clear()
+
+    def histogram(self, name):
+        # counts of the recorded durations per power-of-two millisecond bucket: {upper bound in ms: count}
+        with self._lock:
+            values = np.array(self.durations.get(name, ()), dtype=float) * 1000
+        if not len(values):
+            return {}
+        buckets = 2.0 ** np.ceil(np.log2(np.maximum(values, 1e-3)))
+        bounds, counts = np.unique(buckets, return_counts=True)
+        return dict(zip(bounds.tolist(), counts.tolist()))
+
+    def summary(self):
+        with self._lock:
+            windows = {name: np.array(values, dtype=float) * 1000 for name, values in self.durations.items()}
+        lines = [f"{'stage':<12} {'calls':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, values in sorted(windows.items(), key=lambda item: -item[1].sum()):
+            p50, p95 = np.percentile(values, [50, 95])
+            lines.append(f"{name:<12} {len(values):>6} {values.mean():>9.2f} {p50:>9.2f} {p95:>9.2f} "
+                         f"{values.max():>9.2f}")
+        return "\n".join(lines)
+
+    def dump_trace(self, path=None):
+        path = path or os.path.join(PROFILE_DIR, "mixer_trace.json")
+        with self._lock:
+            events = list(self.events)
+        trace = [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                  'ts': (start - self._origin) * 1e6, 'dur': duration * 1e6}
+                 for name, start, duration, thread in events]
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, trace_file)
+        return path
+
+    def start_profiler(self):
+        # cProfile of the calling thread (the GUI thread when started from the window); worker threads are
+        # profiled from their next thread_profile() on
+        if self._profiler is None:
+            with self._lock:
+                self._thread_profilers.clear()
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextlib.contextmanager
+    def thread_profile(self):
+        # profiles one unit of work of a worker thread (a mix, an image import) while the profiler runs
+        if self._profiler is None:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            profiler = self._thread_profilers.get(ident)
+            if profiler is None:
+                profiler = self._thread_profilers[ident] = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process, which then sees every thread
+            yield
+            return
+        with self._lock:
+            self._profiling_threads.add(ident)
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiling_threads.discard(ident)
+
+    def stop_profiler(self, path=None):
+        # writes the stats of the calling thread merged with those of the worker threads
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        stats = pstats.Stats(self._profiler)
+        with self._lock:
+            # a thread in the middle of a unit of work still has its profiler enabled: it is left out
+            finished = [profiler for ident, profiler in self._thread_profilers.items()
+                        if ident not in self._profiling_threads]
+            self._thread_profilers = {ident: profiler for ident, profiler in self._thread_profilers.items()
+                                      if ident in self._profiling_threads}
+        for profiler in finished:
+            if profiler.getstats():
+                stats.add(profiler)
+        path = path or os.path.join(PROFILE_DIR, "mixer_profile.prof")
+        stats.dump_stats(path)
+        self._profiler = None
+        return path
+
+
+instrumentation = Instrumentation()
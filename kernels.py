@@ -0,0 +1,109 @@
+import os
+import logging
+
+import numpy as np
+
+from instrument import instrumentation
+
+# Fused magnitude/phase recombination: magnitude * exp(1j * phase) written straight into one complex output.
+# numpy evaluates that expression as three full-size complex temporaries (1j * phase, its exponential and the
+# product); the kernels here never hold more than one row chunk of temporaries:
+#   numba     compiled loop over the coefficients (no temporaries at all); single-threaded: the step is memory
+#             bound, and numba's parallel threading layers can hang at exit when first used off the main thread
+#   numexpr   blocked evaluation of the expression (double precision only, numexpr has no complex64)
+#   numpy     cos/sin of a chunk of rows into a scratch buffer, multiplied into the output's real/imaginary parts
+# MIXER_KERNEL selects one (default "auto": numba if it is installed, else numpy; the chunked numpy kernel was
+# as fast as numexpr in our measurements, so numexpr is only used when asked for); MIXER_KERNEL_CHUNK_KB is the
+# size of the numpy row chunks, meant to stay in the CPU cache.
+
+KERNEL = os.environ.get("MIXER_KERNEL", "auto")
+CHUNK_BYTES = int(os.environ.get("MIXER_KERNEL_CHUNK_KB", "256")) * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def recombine_numpy(magnitude, phase, out, chunk_bytes=CHUNK_BYTES):
+    rows = max(1, chunk_bytes // max(1, magnitude[0].nbytes))
+    scratch = np.empty((min(rows, magnitude.shape[0]),) + magnitude.shape[1:], dtype=out.real.dtype)
+    for start in range(0, magnitude.shape[0], rows):
+        stop = min(start + rows, magnitude.shape[0])
+        work = scratch[:stop - start]
+        np.cos(phase[start:stop], out=work)
+        np.multiply(magnitude[start:stop], work, out=out.real[start:stop])
+        np.sin(phase[start:stop], out=work)
+        np.multiply(magnitude[start:stop], work, out=out.imag[start:stop])
+    return out
+
+
+def numexpr_kernel():
+    import numexpr
+
+    def recombine_numexpr(magnitude, phase, out):
+        if out.dtype != np.complex128:
+            return recombine_numpy(magnitude, phase, out)
+        return numexpr.evaluate("magnitude * exp(1j * phase)", local_dict={'magnitude': magnitude, 'phase': phase},
+                                out=out, casting='unsafe')
+    return recombine_numexpr
+
+
+def numba_kernel():
+    import numba
+
+    @numba.njit(cache=True)
+    def recombine_rows(magnitude, phase, out):
+        for row in range(magnitude.shape[0]):
+            for col in range(magnitude.shape[1]):
+                out[row, col] = magnitude[row, col] * np.cos(phase[row, col]) \
+                                + 1j * magnitude[row, col] * np.sin(phase[row, col])
+
+    def recombine_numba(magnitude, phase, out):
+        # numpy's vectorized single precision cos/sin beat the compiled scalar loop
+        if magnitude.ndim != 2 or out.dtype == np.complex64:
+            return recombine_numpy(magnitude, phase, out)
+        recombine_rows(magnitude, phase, out)
+        return out
+    return recombine_numba
+
+
+def create_kernel(name=KERNEL):
+    # recombination function for a kernel name, falling back to numpy when the library is not installed
+    factories = {'numba': numba_kernel, 'numexpr': numexpr_kernel}
+    for candidate in (('numba',) if name == "auto" else (name,)):
+        if candidate == 'numpy':
+            break
+        if candidate not in factories:
+            raise ValueError(f"Unknown recombination kernel: {candidate}")
+        try:
+            return candidate, factories[candidate]()
+        except ImportError:
+            logger.info(f"{candidate} is not installed, recombination falls back to numpy")
+    return 'numpy', recombine_numpy
+
+
+kernel_name, kernel = create_kernel()
+
+
+@instrumentation.timed("recombine")
+def recombine(magnitude, phase, out=None):
+    # magnitude * exp(1j * phase) in one pass; out: optional preallocated complex output
+    magnitude, phase = np.asarray(magnitude), np.asarray(phase)
+    if magnitude.shape != phase.shape:
+        # e.g. a 0 magnitude when no image contributes one
+        magnitude, phase = (np.ascontiguousarray(array) for array in np.broadcast_arrays(magnitude, phase))
+    dtype = np.result_type(magnitude.dtype, phase.dtype, np.complex64)
+    if out is None or out.shape != magnitude.shape or out.dtype != dtype:
+        out = np.empty(magnitude.shape, dtype=dtype)
+    return kernel(magnitude, phase, out)
+
+
+def accumulate(arrays):
+    # sum of the arrays (scalars such as the 0 of an unused component are skipped) in one buffer
+    total = None
+    for array in arrays:
+        if not isinstance(array, np.ndarray):
+            continue
+        if total is None:
+            total = array.copy()
+        else:
+            total += array
+    return total
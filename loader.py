@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from instrument import instrumentation
+
+# Parallel image import: the images of a batch are decoded, fitted to the common shape and transformed
+# concurrently on a thread pool (OpenCV's decoders and the FFT backends release the GIL), so importing several
+# images takes about as long as the slowest one instead of the sum. Each spectrum is put in the spectrum cache
+# under the key the window will use for the image, so the first mix does not transform anything.
+#   MIXER_IMPORT_WORKERS    size of the pool (default: the number of CPUs, at most one per view)
+
+IMPORT_WORKERS = int(os.environ.get("MIXER_IMPORT_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.bmp', '.jpeg', '.tif', '.tiff', '.npy', '.raw')
+
+
+def folder_images(folder):
+    # the image files of a folder, sorted by name
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(folder, name))]
+
+
+class ImageLoader(QObject):
+    # per image of a batch: decoded, then ready (fitted, transformed and its preview pyramid built) or failed;
+    # the signals are queued to the GUI thread in that order
+    decoded = pyqtSignal(object, object)  # (batch, view)
+    ready = pyqtSignal(object, object)  # (batch, view)
+    failed = pyqtSignal(object, object, str)  # (batch, view, error)
+    finished = pyqtSignal(object)  # batch
+
+    def __init__(self, image, spectrum_cache, workers=IMPORT_WORKERS):
+        super().__init__()
+        self.image = image
+        self.spectrum_cache = spectrum_cache
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ImageLoader")
+
+    def submit(self, sources, shapes):
+        # sources: (view, path, spectrum cache key) per image; shapes: those of the other images in use, for the
+        # common shape. Returns the batch, whose 'images', 'pyramids' and 'target' fill in as the import runs
+        batch = {'sources': sources, 'shapes': list(shapes), 'images': {}, 'pyramids': {}, 'target': None,
+                 'start': time.perf_counter()}
+        # the pool only runs the per-image work: waiting for it there could starve it
+        threading.Thread(target=self.run, args=(batch,), name="ImageImport", daemon=True).start()
+        return batch
+
+    def run(self, batch):
+        keys = {view: key for view, path, key in batch['sources']}
+        futures = {self._pool.submit(self.decode, path): view for view, path, key in batch['sources']}
+        for future in as_completed(futures):
+            view = futures[future]
+            try:
+                batch['images'][view] = future.result()
+            except Exception as e:
+                self.failed.emit(batch, view, str(e))
+            else:
+                self.decoded.emit(batch, view)
+
+        # the common shape needs the size of every image of the batch
+        images = batch['images']
+        shapes = batch['shapes'] + [image.shape for image in images.values()]
+        batch['target'] = self.image.normalizer.target_shape(shapes)
+        futures = {self._pool.submit(self.prepare, view, images[view], keys[view], batch['target']): view
+                   for view in images}
+        for future in as_completed(futures):
+            view = futures[future]
+            try:
+                batch['pyramids'][view] = future.result()
+            except Exception as e:
+                self.failed.emit(batch, view, str(e))
+            else:
+                self.ready.emit(batch, view)
+        self.finished.emit(batch)
+
+    def decode(self, path):
+        with instrumentation.thread_profile():
+            return self.image.read_grayscale(path)
+
+    def prepare(self, view, image, key, target):
+        # fitted copy (kept in the normalizer's cache), spectrum (in the spectrum cache) and preview pyramid
+        with instrumentation.thread_profile():
+            fitted = self.image.normalizer.normalize(view, image, target)
+            self.spectrum_cache.get_spectrum(key, fitted, self.image.fourier_transform)
+            return self.image.preview_pyramid(fitted)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -2,12 +2,22 @@ import cv2
 import numpy as np
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtCore import *
-from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtWidgets import QFileDialog, QGraphicsView, QGraphicsScene, QGraphicsPixmapItem
+from PyQt5.QtGui import QPixmap, QImage, QKeySequence
+from PyQt5.QtWidgets import QFileDialog, QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QShortcut
+import os
 import sys
-import matplotlib.pyplot as plt
+import time
+import itertools
 import logging
 import images
+import session
+import fft_backend
+from cache import SpectrumCache, ResultCache
+from render import ComponentRenderer
+from worker import MixWorker
+from loader import ImageLoader, folder_images
+from engine import MixEngine
+from instrument import instrumentation
 from crop import CropItem, CustomGraphicsView
 
 logging.basicConfig(filename="logging_file.log",
@@ -19,6 +29,16 @@ my_logger = logging.getLogger("name")    #i can change the name as i want
 
 my_logger.warning("This Is Warning Message") #this line i will write each time i want to make logging
 
+# idle time (ms) after the last drag event before a preview is refined to full resolution
+REFINE_DELAY_MS = 200
+# region drags are mixed at most once per frame (~60 fps), with the latest rectangle
+REGION_FRAME_MS = 16
+# session directories (see session.py), and the cached planes saved with each image's spectrum: the mixer's and,
+# in half-spectrum mode, the full ones shown in the Fourier views
+SESSION_EXTENSION = ".mixer"
+SESSION_PLANES = [prefix + (component,) for prefix in ((), ('full',))
+                  for component in ('Magnitude', 'Phase', 'Phasor', 'Real', 'Imaginary')]
+
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self, *args, **kwargs):
@@ -28,6 +48,54 @@ class MainWindow(QtWidgets.QMainWindow):
         self.mode = images.Modes()
         self.mixer = images.Mixer4images()
 
+        # Fourier transforms of the loaded images, keyed by (view name, image version)
+        self.spectrum_cache = SpectrumCache()
+        # ... together with their component planes (magnitude, phase, ...), computed once per image version
+        self.mixer.planes = self.spectrum_cache
+        # every change of an image's data gets a new version so cached spectra are never stale
+        self.image_versions = itertools.count()
+        # numpy -> QImage renderer of the Fourier components shown in the FT views
+        self.component_renderer = ComponentRenderer()
+        # mixing runs on a background thread; results come back through a queued signal
+        self.mix_worker = MixWorker(self.update_mix, self.compose_mix, lookup=self.lookup_mix)
+        # outputs already computed, keyed by the mix parameters (see mix_key); hit/miss counts are in dumpProfiling
+        self.result_cache = ResultCache()
+        # worker thread: parameters of the job last applied to the mixer, per combobox
+        self.mix_state = {}
+        self.mix_worker.resultReady.connect(self.showMixResult)
+        # images are imported on a thread pool, which also transforms them into the spectrum cache
+        self.image_loader = ImageLoader(self.img, self.spectrum_cache)
+        self.image_loader.decoded.connect(self.imageDecoded)
+        self.image_loader.ready.connect(self.imageReady)
+        self.image_loader.failed.connect(self.imageFailed)
+        self.image_loader.finished.connect(self.importFinished)
+        # view -> import batch its image is loading in
+        self.view_imports = {}
+
+        # progressive mixing: low-resolution previews while dragging, full resolution when input is idle
+        self.progressive = images.PROGRESSIVE
+        self.preview_engine = MixEngine(self.img)
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(REFINE_DELAY_MS)
+        self.refine_timer.timeout.connect(self.refineMix)
+        # linked crop regions: a handle drag only marks the regions dirty, the frame timer mixes once
+        self.regions_dirty = False
+        self.syncing_regions = False
+        self.region_timer = QTimer(self)
+        self.region_timer.setSingleShot(True)
+        self.region_timer.setInterval(REGION_FRAME_MS)
+        self.region_timer.timeout.connect(self.flushRegionChange)
+
+        # runtime profiling: Ctrl+Shift+P toggles the stage instrumentation (and cProfile), Ctrl+Shift+D dumps it
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self).activated.connect(self.toggleProfiling)
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self).activated.connect(self.dumpProfiling)
+        # sessions: Ctrl+S saves the current mix (with its spectra), Ctrl+O reopens one
+        QShortcut(QKeySequence("Ctrl+S"), self).activated.connect(lambda: self.saveSession())
+        QShortcut(QKeySequence("Ctrl+O"), self).activated.connect(lambda: self.loadSession())
+        # Ctrl+I imports the first images of a folder into the four views
+        QShortcut(QKeySequence("Ctrl+I"), self).activated.connect(lambda: self.importFolder())
+
         # Load the UI Page
         self.original_signal_output = None
         uic.loadUi(r'Mixer.ui', self)
@@ -82,6 +150,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # Connect sliders to update function
         for combobox, slider in self.sliders.items():
             slider.valueChanged.connect(lambda value, cmb=combobox: self.image_mixer(value, cmb))
+            slider.sliderReleased.connect(self.refineMix)
             combobox.currentTextChanged.connect(lambda text, cmb=combobox: self.select_mode(text, cmb))
 
         # Set the scene for self.graphicsView_10 and self.graphicsView_9
@@ -182,38 +251,108 @@ class MainWindow(QtWidgets.QMainWindow):
     def handleViewDoubleClick(self, event, view):
         try:
             if event.button() == Qt.LeftButton:
-                file_dialog = QFileDialog()
-                file_dialog.setFileMode(QFileDialog.ExistingFile)
-                file_path, _ = file_dialog.getOpenFileName(self, "Open Image File", "", "Images (*.png *.jpg *.bmp *.jpeg)")
-                if file_path:
-                    self.img.load_image(file_path, view)
-                    self.displayImage(view, self.img.imageData)
-
-                    view_name = view.objectName()
-                    # view_name = view
-                    for i in range(4):
-                        if str(i+1) in view_name:
-                            self.combobox_mapping[self.comboboxes[i]] = {'image': self.img.view_images[view], 
-                                                                         'view': view,
-                                                                         'ft_label': self.ft_labels[i]}
-                    # print(f"combobox_mapping: {self.combobox_mapping}")
+                # several files fill the views from this one on
+                file_paths, _ = QFileDialog.getOpenFileNames(self, "Open Image Files", "",
+                                                             "Images (*.png *.jpg *.bmp *.jpeg *.tif *.tiff *.npy *.raw)")
+                if file_paths:
+                    self.importImages(file_paths, self.views.index(view))
             
             # reset image with right double-click
             elif event.button() == Qt.RightButton:
                 # print("detected double right-click")
                 # Get the corresponding original image
-                original_image = self.img.view_images.get(view)
-                if original_image is not None:
-                    # Reset the image to its original state
-                    self.img.imageData = original_image
+                if view in self.img.view_images:
+                    # Reset the image to its original state (at the common shape)
+                    self.img.imageData = self.img.normalized(view)
                     # update image data relative to view in self.combobox_mapping
                     self.update_image_data(view, self.img.imageData)
                     # Display the original image
-                    self.displayImage(view,self.img.imageData)
+                    self.displayImage(view, self.img.thumbnail(view))
         
         except Exception as e:
             print("Exception:", e)
 
+    def importImages(self, paths, first=0):
+        # loads the images into the views from index first on, decoding and transforming them all concurrently;
+        # each view shows its image as soon as it is ready (see imageReady)
+        sources = []
+        for view, path in zip(self.views[first:], paths):
+            i = self.views.index(view)
+            combobox, view_name = self.comboboxes[i], view.objectName()
+            # the view's previous image is unloaded right away, so nothing refits it while the new one loads
+            self.img.view_images.pop(view, None)
+            self.img.pyramids.pop(view, None)
+            self.img.normalizer.invalidate(view)
+            self.spectrum_cache.invalidate_image(view_name)
+            self.mixer.invalidate_image(view_name)
+            if self.combobox_mapping.pop(combobox, None) is not None:
+                self.mix_worker.submit(combobox, {'combobox': combobox, 'remove': True, 'mode': None})
+            self.showViewStatus(view, f"Loading {os.path.basename(path)}...")
+            sources.append((view, path, (view_name, next(self.image_versions))))
+        if len(paths) > len(sources):
+            print(f"Only {len(sources)} of the {len(paths)} images fit in the views")
+        batch = self.image_loader.submit(sources, [image.shape for image in self.img.view_images.values()])
+        for view, path, key in sources:
+            # a later import into the same view supersedes this one
+            self.view_imports[view] = batch
+        self.statusbar.showMessage(f"Importing {len(sources)} image{'s' if len(sources) != 1 else ''}...")
+
+    def importFolder(self, folder=None):
+        if folder is None:
+            folder = QFileDialog.getExistingDirectory(self, "Import Images")
+            if not folder:
+                return
+        paths = folder_images(folder)
+        if not paths:
+            print(f"No images in {folder}")
+            return
+        self.importImages(paths)
+
+    def showViewStatus(self, view, text):
+        view.scene().clear()
+        view.scene().addText(text)
+
+    def imageDecoded(self, batch, view):
+        if self.view_imports.get(view) is batch:
+            self.showViewStatus(view, "Transforming...")
+
+    def imageReady(self, batch, view):
+        # the image is fitted, transformed and its preview built: it can be displayed and mixed right away
+        if self.view_imports.get(view) is not batch:
+            return
+        del self.view_imports[view]
+        i = self.views.index(view)
+        path, key = next((path, key) for source_view, path, key in batch['sources'] if source_view is view)
+        self.img.view_images[view] = batch['images'][view]
+        self.img.pyramids[view] = batch['pyramids'][view]
+        self.displayImage(view, self.img.thumbnail(view))
+        self.combobox_mapping[self.comboboxes[i]] = {'image': self.img.normalized(view, batch['target']),
+                                                     'view': view,
+                                                     'ft_label': self.ft_labels[i],
+                                                     # the version the loader's spectrum is cached under
+                                                     'version': key[1],
+                                                     'original_version': key[1],
+                                                     'path': path,
+                                                     'adjustment': None,
+                                                     'derivation': None}
+        if self.comboboxes[i].currentText() != "Select A Component...":
+            self.showFourierComponent(self.comboboxes[i])
+
+    def imageFailed(self, batch, view, error):
+        print("Exception:", error)
+        if self.view_imports.get(view) is batch:
+            del self.view_imports[view]
+            self.showViewStatus(view, "Could not load the image")
+
+    def importFinished(self, batch):
+        # the batch may have changed the common shape: refit the other images (this remixes if needed)
+        self.normalize_shapes()
+        if self.mixer.chosen_mode is not None:
+            self.refineMix()
+        count = len(batch['pyramids'])
+        self.statusbar.showMessage(f"Imported {count} image{'s' if count != 1 else ''} "
+                                   f"in {time.perf_counter() - batch['start']:.2f} s", 5000)
+
     def handleMouseMoveEvent(self, event, view):
         # Get the size of the scene
         scene_rect = view.sceneRect()
@@ -236,26 +375,98 @@ class MainWindow(QtWidgets.QMainWindow):
                 contrast_factor = 1 + 2 * ((mouse_x - midpoint_x) / midpoint_x)  # range -1.0 - 3.0
                 brightness_factor = 100 * (1 - (mouse_y - midpoint_y) / midpoint_y)  # range -100 - 100
                 # Get the corresponding image
-                img_info = self.img.view_images.get(view)
-                if img_info is not None:
-                    self.img.imageData = img_info
+                if view in self.img.view_images:
+                    # adjust the loaded image at the common shape
+                    self.img.imageData = self.img.normalized(view)
                     # Adjust brightness/contrast
                     self.img.imageData = self.img.adjust_brightness_contrast(contrast_factor, brightness_factor)
                     # print(f"image info: {self.img.imageData}")
                     # update image data relative to view in self.combobox_mapping
-                    self.update_image_data(view, self.img.imageData)
+                    self.update_image_data(view, self.img.imageData, (contrast_factor, brightness_factor))
                     
                     # Display the updated image
                     self.displayImage(view, self.img.imageData)
         
-    def update_image_data(self, view, new_image_data):
+    def update_image_data(self, view, new_image_data, adjustment=None):
+        # adjustment: (alpha, beta) when new_image_data is the loaded image with its brightness/contrast adjusted
         # Iterate over the dictionary
         for combobox, info in self.combobox_mapping.items():
             # Check if the view matches
             if info['view'] == view:
-                # Update the image data
+                # Update the image data and drop the spectra of its previous versions (the loaded image's are kept
+                # for the reset and for adjusted spectra)
+                original = self.img.normalized(view)
                 info['image'] = new_image_data
+                info['adjustment'] = adjustment
+                info['version'] = (info['original_version'] if new_image_data is original
+                                   else next(self.image_versions))
+                self.spectrum_cache.invalidate_image(view.objectName(), keep=info['original_version'])
+                self.mixer.invalidate_image(view.objectName(), keep=info['original_version'])
+                info['derivation'] = (self.spectrum_derivation(info, original, *adjustment)
+                                      if adjustment is not None else None)
                 break
+
+    def normalize_shapes(self):
+        # after a load: refit every image whose shape is no longer the common one (the loaded images are kept,
+        # so their fitted copies are recomputed from the full-size data, or taken from the normalizer's cache)
+        target = self.img.target_shape()
+        changed = False
+        for combobox, info in self.combobox_mapping.items():
+            if info['image'].shape != target:
+                view_name = info['view'].objectName()
+                self.spectrum_cache.invalidate_image(view_name)
+                self.mixer.invalidate_image(view_name)
+                original = self.img.normalized(info['view'], target)
+                info['image'] = original
+                info['version'] = info['original_version'] = next(self.image_versions)
+                # the view, its right-click reset and the Fourier view show the refitted image
+                self.img.pyramids[info['view']] = self.img.preview_pyramid(original)
+                if info.get('adjustment') is not None:
+                    # keep the brightness/contrast edit: apply it again to the refitted image
+                    self.img.imageData = original
+                    info['image'] = self.img.adjust_brightness_contrast(*info['adjustment'])
+                    info['version'] = next(self.image_versions)
+                    info['derivation'] = self.spectrum_derivation(info, original, *info['adjustment'])
+                    self.displayImage(info['view'], info['image'])
+                else:
+                    self.displayImage(info['view'], self.img.thumbnail(info['view']))
+                self.showFourierComponent(combobox)
+                changed = True
+        if changed and self.mixer.chosen_mode is not None:
+            # the stored weighted components have the old shape: remix every image (the worker applies all of
+            # these updates before it composes)
+            self.refineMix()
+
+    def spectrum_derivation(self, info, original, alpha, beta):
+        # while nothing saturates, the adjusted image is an affine map of the loaded one and so is its spectrum:
+        # returns (key of the loaded image's spectrum, alpha, beta) of that map, or None when it is clipped.
+        # Nothing is computed here: a drag only redraws the view, the spectrum is derived when a mix needs it
+        if info.get('gray_range', (None,))[0] != info['original_version']:
+            # the loaded image's gray levels, once per version
+            info['gray_range'] = (info['original_version'],) + tuple(cv2.minMaxLoc(original)[:2])
+        sign = self.img.affine_sign(alpha, beta, *info['gray_range'][1:])
+        if sign is None:
+            return None
+        return (info['view'].objectName(), info['original_version']), sign * alpha, sign * beta
+
+    def transform(self, image, derivation=None):
+        # spectrum of an image version that is not cached: derived from the cached spectrum of the loaded image for
+        # an affine brightness/contrast adjustment, else transformed
+        if derivation is not None:
+            original_key, alpha, beta = derivation
+            original_spectrum = self.spectrum_cache.get(original_key)
+            if original_spectrum is not None:
+                return self.img.adjust_spectrum(original_spectrum, image.shape, alpha, beta)
+        return self.img.fourier_transform(image)
+
+    def image_key(self, info):
+        # identity of the image (and its current version) in a combobox_mapping entry
+        return info['view'].objectName(), info['version']
+
+    def get_spectrum(self, info):
+        # Fourier transform of the image in a combobox_mapping entry, computed once per image version
+        return self.spectrum_cache.get_spectrum(self.image_key(info), info['image'],
+                                                lambda image: self.transform(image, info.get('derivation')))
             
     def get_slider_value(self, ft_label):
         # Iterate over the dictionary
@@ -267,6 +478,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 value = slider.value()
                 return combobox, value
     
+    @instrumentation.timed("render")
     def displayImage(self, view, image):
         if len(image.shape) == 2:
             # Grayscale image
@@ -280,7 +492,10 @@ class MainWindow(QtWidgets.QMainWindow):
             view.fitInView(view.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)
     
     def updateFourierComponent(self):
-        self.sender_combobox = self.sender()
+        self.showFourierComponent(self.sender())
+
+    def showFourierComponent(self, combobox):
+        self.sender_combobox = combobox
         selected_component = self.sender_combobox.currentText()
         # print("selected_component:", selected_component)
 
@@ -298,21 +513,14 @@ class MainWindow(QtWidgets.QMainWindow):
             corresponding_image = corresponding_info['image']
             corresponding_ft_label = corresponding_info['ft_label']
 
-            x = self.img.fourier_transform(corresponding_image)
+            # expand to the full shifted spectrum for display (no-op unless in half-spectrum mode)
+            x = self.img.full_spectrum(self.get_spectrum(corresponding_info), corresponding_image.shape)
+            # the planes of the full spectrum are cached apart from the half-spectrum ones the mixer uses
+            key = self.image_key(corresponding_info) + (('full',) if self.img.real_fft else ())
 
-            # map methods in the image class without calling them
-            method_mapping = {
-                r'Real': self.img.realComponent,
-                r'Imaginary': self.img.imaginaryComponent,
-                r'Magnitude': self.img.magnitude,
-                r'Phase': self.img.phase,
-            }
-
-            if selected_component in method_mapping:
-                # function object selected based on selected component
-                component_method = method_mapping[selected_component]
-                # call the method represented by component_method with tge fourier transform of the image as input (x)
-                component_data = component_method(x)  # function call
+            if selected_component in ('Real', 'Imaginary', 'Magnitude', 'Phase'):
+                # component plane of the fourier transform, computed once per image version
+                component_data = self.spectrum_cache.get_component(key, selected_component, x, self.img.component)
 
                 if corresponding_ft_label:
                     self.FT_components[corresponding_ft_label] = component_data
@@ -322,45 +530,206 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             print("Error: Corresponding info not found for the current combobox.")
 
+    @instrumentation.timed("render")
     def displayFourierComponent(self, view, component, title):
         if title == 'Magnitude':
             my_logger.info(
                 "Applying log normalization to the magnitude component to reduce the dynamic range and improve visibility.")
-            plt.imshow(np.log(component), cmap='gray')
-        elif title == 'Real' or title == 'Imaginary':
+        elif (title == 'Real' or title == 'Imaginary') and my_logger.isEnabledFor(logging.INFO):
+            # only pay for the statistics when they are actually logged
             my_logger.info("Before transformation:")
             my_logger.info("Min: {}".format(np.min(component)))
             my_logger.info("Max: {}".format(np.max(component)))
             my_logger.info("Average: {}".format(np.mean(component)))
-
             my_logger.info(
                 "Applying histogram equalization to the real/imaginary component to enhance contrast and improve visibility.")
-            equalized_component = cv2.equalizeHist(component.astype(np.uint8))
-
-            my_logger.info("After transformation:")
-            my_logger.info("Min: {}".format(np.min(equalized_component)))
-            my_logger.info("Max: {}".format(np.max(equalized_component)))
-            my_logger.info("Average: {}".format(np.mean(equalized_component)))
-
-            plt.imshow(equalized_component, cmap='gray')
-        else:
-            plt.imshow(component, cmap='gray')
 
-        # view_name = view.objectName()
-
-        plt.gcf().set_size_inches(component.shape[1] / 79, component.shape[0] / 79)  # resize image
-        plt.axis('off')  # Turn off axis labels
-        # plt.savefig(f'temp_{view_name}.png', bbox_inches='tight', pad_inches=0)  # Save with tight bounding box
-        plt.savefig('temp.png', bbox_inches='tight', pad_inches=0)  # Save with tight bounding box
-        plt.close()
-
-        # q_image = QImage(f'temp_{view_name}.png')
-        q_image = QImage('temp.png')
+        # normalize in numpy and wrap the result in a QImage (no matplotlib figure or temp file)
+        q_image = self.component_renderer.render(view, component, title)
         pixmap = QPixmap.fromImage(q_image)
         view.scene().clear()
         view.scene().addPixmap(pixmap)
         view.fitInView(view.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)  # Fit the image within the view
         
+    def toggleProfiling(self):
+        if instrumentation.toggle():
+            instrumentation.start_profiler()
+            print("Profiling enabled")
+        else:
+            self.dumpProfiling()
+            print("Profiling disabled")
+
+    def dumpProfiling(self):
+        summary = instrumentation.summary()
+        print(summary)
+        my_logger.info("Stage latencies:\n" + summary)
+        stats = self.result_cache.stats()
+        print("Result cache: {hits} hits, {misses} misses ({hit_rate:.0%}), {entries} outputs, {bytes} bytes"
+              .format(**stats))
+        my_logger.info(f"Result cache: {stats}")
+        print(f"Trace written to {instrumentation.dump_trace()}")
+        profile_path = instrumentation.stop_profiler()
+        if profile_path:
+            print(f"cProfile stats written to {profile_path}")
+        if instrumentation.enabled:
+            # keep profiling after an intermediate dump
+            instrumentation.start_profiler()
+
+    def spectrum_format(self):
+        # transform settings the cached spectra and planes depend on
+        return {'real_fft': self.img.real_fft, 'dtype': np.dtype(self.img.complex_dtype).name}
+
+    def region_state(self):
+        # crop rectangles as fractions of their Fourier view, so they do not depend on the displayed size
+        regions = {}
+        for ft_label, crop_item in self.FT_regions.items():
+            rect, extern = crop_item.rect(), crop_item.getExternRect()
+            regions[str(self.ft_labels.index(ft_label))] = {
+                'rect': [rect.x() / extern.width(), rect.y() / extern.height(),
+                         rect.width() / extern.width(), rect.height() / extern.height()],
+                'inside': crop_item.shade_inside}
+        return {'active': self.active_region, 'items': regions}
+
+    def saveSession(self, path=None):
+        # the loaded images (at the common shape), their adjustments, the components, weights, regions and output
+        # selection, with the spectrum of every image and the component planes cached so far
+        if not self.combobox_mapping:
+            print("No images loaded yet.")
+            return
+        if path is None:
+            path, _ = QFileDialog.getSaveFileName(self, "Save Session", "", f"Mixer sessions (*{SESSION_EXTENSION})")
+            if not path:
+                return
+            if not path.endswith(SESSION_EXTENSION):
+                path += SESSION_EXTENSION
+        views, arrays = [], {}
+        for i, combobox in enumerate(self.comboboxes):
+            entry = {'component': combobox.currentText(), 'weight': self.sliders[combobox].value()}
+            info = self.combobox_mapping.get(combobox)
+            if info is not None:
+                name = f"image{i + 1}"
+                key = self.image_key(info)
+                arrays[name] = self.img.normalized(info['view'])
+                arrays[f"{name}_spectrum"] = self.get_spectrum(info)
+                planes = []
+                for suffix in SESSION_PLANES:
+                    plane = self.spectrum_cache.get(key + suffix)
+                    if plane is not None:
+                        arrays[f"{name}_" + "_".join(suffix).lower()] = plane
+                        planes.append(list(suffix))
+                entry.update({'image': name, 'path': info.get('path'), 'adjustment': info.get('adjustment'),
+                              'planes': planes})
+            views.append(entry)
+        state = {'views': views, 'regions': self.region_state(), 'output': self.choose_output.currentText(),
+                 'spectra': self.spectrum_format()}
+        try:
+            session.save_session(path, state, arrays)
+        except OSError as e:
+            print(f"Could not save session {path}: {e}")
+            return
+        print(f"Session saved to {path}")
+
+    def loadSession(self, path=None):
+        # replaces the current images and settings; the saved arrays are memory-mapped, and the spectra and planes
+        # go straight into the spectrum cache when they were computed with the current transform settings
+        if path is None:
+            path = QFileDialog.getExistingDirectory(self, "Open Session")
+            if not path:
+                return
+        try:
+            state, arrays = session.load_session(path)
+        except IOError as e:
+            print(e)
+            return
+        reuse = state['spectra'] == self.spectrum_format()
+
+        # unload everything: pending imports, regions, displayed images and components, cached spectra and the
+        # mixer's state
+        self.view_imports.clear()
+        self.FT_regions.clear()
+        self.FT_cropItems = {}
+        self.crop_items = []
+        self.active_region = self.mixer.active_region = False
+        for view, ft_label in zip(self.views, self.ft_labels):
+            view.scene().clear()
+            ft_label.scene().clear()
+            self.img.normalizer.invalidate(view)
+            self.spectrum_cache.invalidate_image(view.objectName())
+            self.mixer.invalidate_image(view.objectName())
+        self.img.view_images.clear()
+        self.img.pyramids.clear()
+        self.FT_components.clear()
+        self.combobox_mapping.clear()
+        loaded = [i for i, entry in enumerate(state['views']) if 'image' in entry]
+        for i in loaded:
+            self.img.view_images[self.views[i]] = arrays[state['views'][i]['image']]
+        for i, combobox in enumerate(self.comboboxes):
+            if i not in loaded:
+                # drops the weighted components of the combobox's previous image on the mix worker
+                self.mix_worker.submit(combobox, {'combobox': combobox, 'remove': True, 'mode': None})
+
+        for i in loaded:
+            entry = state['views'][i]
+            view, combobox = self.views[i], self.comboboxes[i]
+            original = self.img.normalized(view)
+            self.img.pyramids[view] = self.img.preview_pyramid(original)
+            version = next(self.image_versions)
+            info = {'image': original, 'view': view, 'ft_label': self.ft_labels[i], 'version': version,
+                    'original_version': version, 'path': entry['path'], 'adjustment': None, 'derivation': None}
+            self.combobox_mapping[combobox] = info
+            if entry['adjustment'] is not None:
+                self.img.imageData = original
+                info['image'] = self.img.adjust_brightness_contrast(*entry['adjustment'])
+                info['adjustment'] = tuple(entry['adjustment'])
+                info['version'] = next(self.image_versions)
+                info['derivation'] = self.spectrum_derivation(info, original, *info['adjustment'])
+                self.displayImage(view, info['image'])
+            else:
+                self.displayImage(view, self.img.thumbnail(view))
+            # (a different shape setting may have refitted the saved image: its spectra are then stale)
+            if reuse and original is arrays[entry['image']]:
+                key = self.image_key(info)
+                self.spectrum_cache.put(key, arrays[f"{entry['image']}_spectrum"])
+                for suffix in entry['planes']:
+                    plane = arrays[f"{entry['image']}_" + "_".join(suffix).lower()]
+                    self.spectrum_cache.put(key + tuple(suffix), plane)
+
+        for combobox, entry in zip(self.comboboxes, state['views']):
+            slider = self.sliders[combobox]
+            slider.blockSignals(True)
+            slider.setValue(entry['weight'])
+            slider.blockSignals(False)
+            self.line_edits[combobox].setText(f"{entry['weight']}%")
+        # the components are chosen with the comboboxes' signals blocked: enabling the items of one combobox
+        # re-emits the text of the others, and a "Select A Component..." would reset them all
+        for combobox in self.comboboxes:
+            combobox.blockSignals(True)
+        for combobox, entry in zip(self.comboboxes, state['views']):
+            combobox.setCurrentText(entry['component'])
+        for combobox, entry in zip(self.comboboxes, state['views']):
+            if entry['component'] != "Select A Component...":
+                self.select_mode(entry['component'], combobox)
+        for combobox in self.comboboxes:
+            combobox.blockSignals(False)
+            self.showFourierComponent(combobox)
+
+        if state['regions']['active']:
+            self.on_button_click()
+            for index, region in state['regions']['items'].items():
+                crop_item = self.FT_regions.get(self.ft_labels[int(index)])
+                if crop_item is None:
+                    continue
+                extern = crop_item.getExternRect()
+                x, y, width, height = region['rect']
+                # the size grip shares the crop item's rectangle
+                crop_item.rect().setRect(x * extern.width(), y * extern.height(),
+                                         width * extern.width(), height * extern.height())
+                crop_item.sizeGripItem.doResize()
+                crop_item.shade_inside = region['inside']
+                crop_item.create_path()
+        self.choose_output.setCurrentText(state['output'])
+        self.refineMix()
+
     def select_mode(self, component, combobox):
         if component == "Magnitude" or component == "Phase":
             self.mixer.chosen_mode = "magnitude_phase mode"
@@ -370,7 +739,8 @@ class MainWindow(QtWidgets.QMainWindow):
         # print("enough")
         self.mode.choose_mode(component, combobox, self.comboboxes)
 
-    def save_cropped_region(self, ft_label):
+    def save_cropped_region(self, ft_label, shape=None):
+        # shape: size of the spectrum the mask is built for (default: the displayed Fourier component)
         # Get the coordinates of the cropping rectangle
         crop_item = self.FT_regions[ft_label]
         extern_rect = crop_item.getExternRect()
@@ -383,9 +753,11 @@ class MainWindow(QtWidgets.QMainWindow):
         # Get the Fourier component corresponding to the ft_label
         fourier_component = self.FT_components[ft_label]
         if fourier_component is not None:
+            if shape is None:
+                shape = fourier_component.shape
             # Calculate the scaling factor
-            scale_x = fourier_component.shape[1] / extern_rect.width()
-            scale_y = fourier_component.shape[0] / extern_rect.height()
+            scale_x = shape[1] / extern_rect.width()
+            scale_y = shape[0] / extern_rect.height()
             
             # Map the coordinates of the cropping rectangle on the view back to the indices of the Fourier component data array
             x = int(x * scale_x)
@@ -393,10 +765,8 @@ class MainWindow(QtWidgets.QMainWindow):
             width = int(width * scale_x)
             height = int(height * scale_y)
             
-            # Create a mask of zeros with the same shape as the Fourier component
-            mask = np.zeros(fourier_component.shape).astype(bool)
-            # Set the values in the mask to True for the pixels inside the rectangle
-            mask[y:y+height, x:x+width] = 1
+            # Region of the rectangle on a spectrum of that shape (memoized and shared by all images)
+            mask = self.img.rect_region(shape, x, y, width, height)
 
             return mask, crop_item.shade_inside
         
@@ -406,49 +776,209 @@ class MainWindow(QtWidgets.QMainWindow):
         # Get the corresponding image for the current combobox
         corresponding_info = self.combobox_mapping.get(combobox)
         if corresponding_info:
-            corresponding_image = corresponding_info['image']
-
-            corresponding_label = corresponding_info['ft_label']
-            
             # Update the line edit with the current weight
             line_edit = self.line_edits.get(combobox)
             # print('line_edit.text()',line_edit.text())
             if line_edit:
                 line_edit.setText(f"{weight_value}%")
 
-            # get current mode
-            current_component = combobox.currentText()
-            # print("current_component:", current_component)
-
-            # calculate fourier transform for the image
-            image_ft = self.img.fourier_transform(corresponding_image)
-            
-            if self.active_region and any(isinstance(item, CropItem) for item in corresponding_label.scene().items()):
-                # Get the cropped region of the Fourier component
-                mask, flag = self.save_cropped_region(corresponding_label)
-            else:
-                mask = None  # a default value
-                flag = None
-
-            image = self.mixer.mix(self.weights_dict, current_component, image_ft, weight_value, combobox, mask, flag)
-
-            selected_output = self.choose_output.currentText()
+            if self.progressive and self.isInteracting():
+                # mid-drag: mix a low-resolution preview now, the full resolution once input stops
+                self.submitPreview()
+                self.refine_timer.start()
+                return
+
+            # the FFT and the mix itself run on the mix worker thread
+            self.mix_worker.submit(combobox, self.mix_job(combobox, weight_value))
+
+    def mix_job(self, combobox, weight_value, level=0):
+        # snapshot of everything the mix of one image needs, at a pyramid level (0: full resolution)
+        corresponding_info = self.combobox_mapping[combobox]
+        corresponding_image = corresponding_info['image']
+        corresponding_label = corresponding_info['ft_label']
+        shape = self.img.level_shape(corresponding_image.shape, level)
+
+        # get current mode
+        current_component = combobox.currentText()
+        # print("current_component:", current_component)
+
+        if self.active_region and any(isinstance(item, CropItem) for item in corresponding_label.scene().items()):
+            # Get the cropped region of the Fourier component; a preview keeps the part of the full resolution
+            # region over the low frequencies it is mixed from
+            mask, flag = self.save_cropped_region(corresponding_label, corresponding_image.shape)
+            mask = self.img.downsample_mask(self.img.half_mask(mask), corresponding_image.shape, level)
+        else:
+            mask = None  # a default value
+            flag = None
+
+        return {'combobox': combobox,
+                'image': corresponding_image,
+                'key': self.image_key(corresponding_info),
+                'derivation': corresponding_info.get('derivation'),
+                'level': level,
+                'shape': shape,
+                'component': current_component,
+                'weight': weight_value,
+                'mask': mask,
+                'flag': flag,
+                'mode': self.mixer.chosen_mode,
+                'view': self.selected_output_view()}
+
+    def selected_output_view(self):
+        selected_output = self.choose_output.currentText()
+
+        if selected_output == "Output 2":
+            selected_graphics_view = self.graphicsView_9
+        else:
+            # Handle other cases or provide a default view
+            selected_graphics_view = self.graphicsView_10
+        return selected_graphics_view
 
-            if selected_output == "Output 2":
-                selected_graphics_view = self.graphicsView_9
-            else:
-                # Handle other cases or provide a default view
-                selected_graphics_view = self.graphicsView_10
+    def isInteracting(self):
+        # a slider or a region handle is being dragged
+        return (any(slider.isSliderDown() for slider in self.sliders.values())
+                or any(ft_label.drag for ft_label in self.ft_labels))
 
-            # Call the display function with the selected graphics view
-            self.displayImage(selected_graphics_view, image)
+    def submitPreview(self):
+        if not self.combobox_mapping:
+            return
+        level = max(self.img.pyramid_level(info['image'].shape) for info in self.combobox_mapping.values())
+        if level == 0:
+            # small images: the full resolution is already interactive
+            self.refineMix()
+            return
+        jobs = [self.mix_job(combobox, self.sliders[combobox].value(), level) for combobox in self.combobox_mapping]
+        # a single source, so pending previews replace each other
+        self.mix_worker.submit('preview', {'preview': jobs, 'mode': self.mixer.chosen_mode,
+                                           'view': self.selected_output_view()})
+
+    def regionChanged(self):
+        # a crop region moved: schedule a single mix for the next frame, whatever the number of move events
+        self.regions_dirty = True
+        if not self.region_timer.isActive():
+            self.region_timer.start()
+
+    def flushRegionChange(self):
+        if not self.regions_dirty:
+            return
+        self.regions_dirty = False
+        if self.progressive and self.isInteracting():
+            self.submitPreview()
+            self.refine_timer.start()
+        else:
+            self.refineMix()
+
+    def refineMix(self):
+        # input stopped: recompute every image at full resolution
+        self.refine_timer.stop()
+        # covers any region change still waiting for its frame
+        self.region_timer.stop()
+        self.regions_dirty = False
+        for combobox in self.combobox_mapping:
+            self.mix_worker.submit(combobox, self.mix_job(combobox, self.sliders[combobox].value()))
+
+    def get_level_spectrum(self, job):
+        # spectrum of a job's image at the job's pyramid level, cached like the full resolution one
+        image_ft = self.spectrum_cache.get_spectrum(job['key'], job['image'],
+                                                    lambda image: self.transform(image, job.get('derivation')))
+        if job['level'] == 0:
+            return image_ft
+        return self.spectrum_cache.get_spectrum(
+            job['key'] + (job['level'],), image_ft,
+            lambda spectrum: self.img.downsample_spectrum(spectrum, job['image'].shape, job['level']))
+
+    def job_signature(self, job):
+        # the parameters of one image's job that the output depends on
+        mask = job['mask']
+        return (job['key'], job['component'], self.result_cache.quantize(job['weight']),
+                None if mask is None else (mask.key, bool(job['flag'])))
+
+    def mix_key(self, jobs, latest):
+        # result cache key of the output the newest job asks for, once the pending jobs are applied
+        if 'preview' in latest:
+            sources = tuple(self.job_signature(source) for source in latest['preview'])
+            return ('preview', sources, latest['preview'][0]['shape'], latest['mode'], self.mixer.output_scaling)
+        state = dict(self.mix_state)
+        for job in jobs.values():
+            if 'remove' in job:
+                state.pop(job['combobox'].objectName(), None)
+            elif 'preview' not in job:
+                state[job['combobox'].objectName()] = self.job_signature(job)
+        return (tuple(sorted(state.items())), latest['shape'], latest['mode'], self.mixer.output_scaling)
+
+    def lookup_mix(self, jobs, latest):
+        # runs on the mix worker thread: the output of these jobs if it was computed before
+        if latest['mode'] is None:
+            return None
+        latest['result_key'] = self.mix_key(jobs, latest)
+        return self.result_cache.lookup(latest['result_key'])
+
+    def update_mix(self, job):
+        # runs on the mix worker thread: store the weighted component of one image
+        if 'preview' in job:
+            return
+        if 'remove' in job:
+            # the combobox's image was unloaded (by opening a session)
+            self.mix_state.pop(job['combobox'].objectName(), None)
+            self.mixer.remove(self.weights_dict, job['combobox'])
+            return
+        self.mix_state[job['combobox'].objectName()] = self.job_signature(job)
+        # fourier transform of the image (cached until the image changes)
+        image_ft = self.get_level_spectrum(job)
+        self.mixer.update(self.weights_dict, job['component'], image_ft, job['weight'], job['combobox'],
+                          job['mask'], job['flag'], job['shape'], job['key'], job['mode'])
+
+    def compose_mix(self, job):
+        # runs on the mix worker thread: inverse transform of the current mix, kept in the result cache
+        result = self.compute_mix(job)
+        if result is not None and 'result_key' in job:
+            self.result_cache.put(job['result_key'], result)
+        return result
+
+    def compute_mix(self, job):
+        # the mix itself: previews on the stacked engine, full resolution from the stored weighted components
+        if 'remove' in job:
+            return None
+        if 'preview' in job:
+            # previews are mixed from scratch on their own stacked engine, leaving the full resolution state untouched
+            if job['mode'] is None:
+                return None
+            sources = job['preview']
+            self.preview_engine.set_sources([(source['key'] + (source['level'],), self.get_level_spectrum(source))
+                                             for source in sources])
+            return self.preview_engine.mix([source['component'] for source in sources],
+                                           [source['weight'] for source in sources], job['mode'],
+                                           [source['mask'] for source in sources],
+                                           [source['flag'] for source in sources],
+                                           sources[0]['shape'], self.mixer.output_scaling)
+        return self.mixer.compose(self.weights_dict, job['shape'], job['mode'])
+
+    def showMixResult(self, job, image):
+        # back on the GUI thread: display the newest mix in the output view it was requested for
+        if image is not None:
+            self.displayImage(job['view'], image)
 
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
+    # report which FFT implementation the transforms run on
+    backend = fft_backend.get_backend()
+    print(f"FFT backend: {backend.describe()}")
+    my_logger.info(f"FFT backend: {backend.describe()}")
     main = MainWindow()
     main.show()
-    sys.exit(app.exec_())
+    # python main.py session.mixer reopens a saved session
+    if len(sys.argv) > 1:
+        main.loadSession(sys.argv[1])
+    if instrumentation.enabled:
+        instrumentation.start_profiler()
+    exit_code = app.exec_()
+    main.image_loader.shutdown()
+    main.mix_worker.stop()
+    if instrumentation.enabled:
+        main.dumpProfiling()
+    backend.shutdown()
+    sys.exit(exit_code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+from PyQt5.QtGui import QImage
+
+
+# Renders Fourier components straight from numpy arrays into 8-bit grayscale QImages.
+# Every target (e.g. an FT view) keeps its own float/uint8 work buffers, which are reused as long as
+# the component shape does not change, so a view update does not allocate full-size temporaries.
+class ComponentRenderer:
+    def __init__(self):
+        self._buffers = {}  # target -> (float32 work buffer, uint8 output buffer)
+
+    def buffers(self, target, shape):
+        buffers = self._buffers.get(target)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = (np.empty(shape, dtype=np.float32), np.empty(shape, dtype=np.uint8))
+            self._buffers[target] = buffers
+        return buffers
+
+    def release(self, target):
+        self._buffers.pop(target, None)
+
+    def normalize(self, target, component, title):
+        work, out = self.buffers(target, component.shape)
+        if title == 'Magnitude':
+            # log scaling reduces the dynamic range of the magnitude so more than the DC term is visible
+            np.log1p(component, out=work, casting='unsafe')
+        elif title == 'Real' or title == 'Imaginary':
+            # signed log compression followed by histogram equalization to enhance contrast
+            np.abs(component, out=work, casting='unsafe')
+            np.log1p(work, out=work)
+            np.copysign(work, component, out=work, casting='unsafe')
+        else:
+            np.copyto(work, component, casting='unsafe')
+
+        self.stretch(work, out)
+        if title == 'Real' or title == 'Imaginary':
+            cv2.equalizeHist(out, out)
+        return out
+
+    @staticmethod
+    def stretch(work, out):
+        # linearly map [min, max] of the work buffer onto 0..255 (what imshow with a gray colormap shows)
+        low, high = float(work.min()), float(work.max())
+        scale = 255.0 / (high - low) if high > low else 0.0
+        np.subtract(work, low, out=work)
+        np.multiply(work, scale, out=work)
+        np.copyto(out, work, casting='unsafe')
+
+    def render(self, target, component, title):
+        out = self.normalize(target, component, title)
+        height, width = out.shape
+        # the QImage wraps the output buffer without copying it; QPixmap.fromImage makes the only copy
+        return QImage(out.data, width, height, out.strides[0], QImage.Format_Grayscale8)
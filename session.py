@@ -0,0 +1,51 @@
+import json
+import os
+
+import numpy as np
+
+# Mixing sessions on disk: a directory (name.mixer) holding session.json, the window state, and one .npy file
+# per array (the loaded images, their spectra and component planes). Arrays are opened with
+# np.load(mmap_mode='r'), so reopening even a large session is immediate and only the pages that are actually
+# used are ever read.
+
+SESSION_FILE = "session.json"
+SESSION_VERSION = 1
+
+
+def save_session(path, state, arrays):
+    # state: JSON-serializable dict; arrays: name -> ndarray (names are used as file names)
+    os.makedirs(path, exist_ok=True)
+    files = {}
+    for name, array in arrays.items():
+        file_name = f"{name}.npy"
+        temporary = os.path.join(path, f".{file_name}.tmp")
+        with open(temporary, 'wb') as array_file:
+            np.save(array_file, np.ascontiguousarray(array))
+        # replaced, not overwritten: a session saved over itself may still have the old file mapped
+        os.replace(temporary, os.path.join(path, file_name))
+        files[name] = file_name
+    for file_name in os.listdir(path):
+        if file_name.endswith('.npy') and file_name not in files.values():
+            os.remove(os.path.join(path, file_name))
+    temporary = os.path.join(path, f".{SESSION_FILE}.tmp")
+    with open(temporary, 'w') as session_file:
+        json.dump({'version': SESSION_VERSION, 'state': state, 'arrays': files}, session_file, indent=2)
+    os.replace(temporary, os.path.join(path, SESSION_FILE))
+
+
+def load_session(path):
+    # (state, name -> read-only memory-mapped array)
+    try:
+        with open(os.path.join(path, SESSION_FILE)) as session_file:
+            session = json.load(session_file)
+    except (OSError, ValueError) as e:
+        raise IOError(f"Could not read session {path}: {e}")
+    if session.get('version') != SESSION_VERSION:
+        raise IOError(f"Unsupported session version {session.get('version')} in {path}")
+    arrays = {}
+    for name, file_name in session['arrays'].items():
+        try:
+            arrays[name] = np.load(os.path.join(path, file_name), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            raise IOError(f"Could not read {file_name} of session {path}: {e}")
+    return session['state'], arrays
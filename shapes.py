@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import cv2 as cv
+
+from cache import LRUCache
+from instrument import instrumentation
+
+# Shape normalization: every image that is mixed has the same (target) shape.
+# The target is the smallest height and width of the images in use, optionally snapped to FFT-friendly lengths
+# (products of 2, 3 and 5, which the FFT backends transform several times faster than e.g. prime lengths).
+# Images are fitted to it by resizing (the default) or by cropping their centre, and the fitted copies are
+# cached per target shape, so adding an image that does not change the target does not refit the others.
+#   MIXER_FAST_SHAPE=1        snap the target to FFT-friendly lengths
+#   MIXER_SHAPE_FIT=crop      crop instead of resizing
+#   MIXER_RESIZE_CACHE_MB     budget of the fitted copies
+
+FAST_SHAPE = os.environ.get("MIXER_FAST_SHAPE", "0") == "1"
+SHAPE_FIT = os.environ.get("MIXER_SHAPE_FIT", "resize")
+RESIZE_CACHE_MB = int(os.environ.get("MIXER_RESIZE_CACHE_MB", "256"))
+
+
+def is_fast_len(n):
+    for factor in (2, 3, 5):
+        while n % factor == 0:
+            n //= factor
+    return n == 1
+
+
+def next_fast_len(n):
+    # smallest FFT-friendly length >= n
+    try:
+        import scipy.fft
+        return scipy.fft.next_fast_len(n, real=True)
+    except ImportError:
+        while not is_fast_len(n):
+            n += 1
+        return n
+
+
+def previous_fast_len(n):
+    # largest FFT-friendly length <= n
+    while n > 1 and not is_fast_len(n):
+        n -= 1
+    return max(n, 1)
+
+
+class ShapeNormalizer:
+    def __init__(self, fast=FAST_SHAPE, fit=SHAPE_FIT, max_bytes=RESIZE_CACHE_MB * 1024 * 1024):
+        if fit not in ("resize", "crop"):
+            raise ValueError(f"Unknown shape fit: {fit}")
+        self.fast = fast
+        self.fit = fit
+        self.fitted = LRUCache(max_bytes)  # (image key, target shape) -> fitted image
+
+    def target_shape(self, shapes):
+        # common (height, width) of images of the given shapes
+        shapes = list(shapes)
+        if not shapes:
+            return None
+        height, width = min(shape[0] for shape in shapes), min(shape[1] for shape in shapes)
+        if self.fast:
+            # a crop cannot grow the images, a resize can stretch them by the few pixels up to the next length
+            snap = previous_fast_len if self.fit == "crop" else next_fast_len
+            height, width = snap(height), snap(width)
+        return height, width
+
+    def normalize(self, key, image, target):
+        # image fitted to the target shape; key identifies the image (e.g. its view) for the cache
+        if image.shape[:2] == tuple(target):
+            return image
+        fitted = self.fitted.get((key, tuple(target)))
+        if fitted is None:
+            fitted = self.fitted.put((key, tuple(target)), self.fit_image(image, target))
+        return fitted
+
+    @instrumentation.timed("resize")
+    def fit_image(self, image, target):
+        height, width = target
+        if self.fit == "crop":
+            top, left = (image.shape[0] - height) // 2, (image.shape[1] - width) // 2
+            return np.ascontiguousarray(image[top:top + height, left:left + width])
+        return cv.resize(image, (width, height))
+
+    def invalidate(self, key):
+        # drop the fitted copies of an image that was replaced
+        self.fitted.invalidate(lambda cache_key: cache_key[0] == key)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from images import Image  # noqa: E402
+
+# The spectrum of a brightness/contrast adjusted image is derived from the spectrum of the loaded image while the
+# adjustment is affine (affine_sign); it must match the transform of the convertScaleAbs output up to its rounding.
+
+SHAPES = [(64, 64), (48, 61)]
+AFFINE = [(1.2, 5, 1), (0.5, -10, 1), (-0.5, -20, -1), (-1.0, 0, -1)]
+CLIPPED = [(3.0, 0), (1.0, 100), (-1.0, 100), (1.0, -100)]
+
+
+def source_image(shape):
+    # gray levels 40..200, so the affine cases neither saturate nor fold
+    return np.random.default_rng(sum(shape)).integers(40, 201, shape).astype(np.uint8)
+
+
+@pytest.mark.parametrize("real_fft", [False, True])
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("alpha, beta, sign", AFFINE)
+def test_derived_spectrum_matches_transform_of_adjusted_image(real_fft, shape, alpha, beta, sign):
+    image = Image(real_fft=real_fft)
+    original = source_image(shape)
+    adjusted = cv.convertScaleAbs(original, alpha=alpha, beta=beta)
+    assert image.affine_sign(alpha, beta, int(original.min()), int(original.max())) == sign
+
+    derived = image.adjust_spectrum(image.fourier_transform(original), shape, sign * alpha, sign * beta)
+    expected = image.fourier_transform(adjusted)
+    if not real_fft:
+        derived, expected = np.fft.ifftshift(derived), np.fft.ifftshift(expected)
+    # convertScaleAbs rounds every pixel to the nearest gray level
+    difference = image.inverseFourier(derived, shape) - image.inverseFourier(expected, shape)
+    assert np.abs(difference).max() <= 0.5 + 1e-6
+
+
+@pytest.mark.parametrize("alpha, beta", CLIPPED)
+def test_clipped_adjustment_is_not_affine(alpha, beta):
+    original = source_image(SHAPES[0])
+    assert Image().affine_sign(alpha, beta, int(original.min()), int(original.max())) is None
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import MixEngine  # noqa: E402
+from images import Image  # noqa: E402
+
+# A preview mixed with a region active must be the downsampled full resolution mix: the region keeps the same
+# frequencies at every pyramid level, not the same fraction of each level's spectrum.
+
+SHAPES = [(256, 256), (96, 131)]
+RECTS = [(64, 64, 128, 128), (100, 30, 50, 70), (0, 0, 256, 40)]
+MODES = {"magnitude_phase mode": ('Magnitude', 'Phase', 'Magnitude', 'Phase'),
+         "real_imaginary mode": ('Real', 'Imaginary', 'Real', 'Imaginary')}
+WEIGHTS = [70, 100, 40, 25]
+
+
+def source_images(shape):
+    rng = np.random.default_rng(sum(shape))
+    return [rng.integers(0, 256, shape).astype(np.uint8) for _ in range(4)]
+
+
+@pytest.mark.parametrize("real_fft", [False, True])
+@pytest.mark.parametrize("mode", list(MODES))
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("rect", RECTS)
+@pytest.mark.parametrize("inside", [True, False])
+@pytest.mark.parametrize("level", [1, 2])
+def test_preview_region_matches_downsampled_full_mix(real_fft, mode, shape, rect, inside, level):
+    image = Image(real_fft=real_fft)
+    spectra = [image.fourier_transform(source) for source in source_images(shape)]
+    mask = image.half_mask(image.rect_region(shape, *rect))
+    components = list(MODES[mode])
+
+    full = MixEngine(image)
+    full.set_sources(list(enumerate(spectra)))
+    spectrum = image.downsample_spectrum(full.mix_spectrum(components, WEIGHTS, mode, [mask] * 4, [inside] * 4),
+                                         shape, level)
+    if not real_fft:
+        spectrum = np.fft.ifftshift(spectrum)
+    level_shape = image.level_shape(shape, level)
+    expected = image.to_uint8(image.inverseFourier(spectrum, level_shape)).astype(int)
+
+    preview = MixEngine(image)
+    preview.set_sources([(slot, image.downsample_spectrum(spectrum, shape, level))
+                         for slot, spectrum in enumerate(spectra)])
+    level_mask = image.downsample_mask(mask, shape, level)
+    mixed = preview.mix(components, WEIGHTS, mode, [level_mask] * 4, [inside] * 4, level_shape).astype(int)
+    assert np.abs(mixed - expected).max() <= 1
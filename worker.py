@@ -0,0 +1,95 @@
+import threading
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from instrument import instrumentation
+
+
+# Runs the mixer off the GUI thread.
+# Jobs are submitted per source (e.g. per combobox) and only the newest job of every source is kept, so a fast
+# slider drag collapses into one update instead of a queue of stale recomputations. All pending updates are
+# applied before a single compose, and a result that was superseded while it was being computed is dropped
+# (unless nothing has been shown for max_latency seconds, so a continuous drag still refreshes the output).
+# An optional lookup returns an already computed result for the pending jobs; they are then not applied yet,
+# but kept and applied before the next compose that has to be computed.
+class MixWorker(QObject):
+    resultReady = pyqtSignal(object, object)  # (newest job, mixed image)
+
+    def __init__(self, update, compose, max_latency=0.1, lookup=None):
+        super().__init__()
+        self.update_function = update  # called with every pending job
+        self.compose_function = compose  # called once with the newest job, returns the result
+        self.lookup_function = lookup  # called with the pending jobs and the newest job, returns a result or None
+        self.max_latency = max_latency
+        self._pending = {}  # source -> newest job
+        self._deferred = {}  # source -> job whose result came from the lookup, not applied yet
+        self._latest = None
+        self._generation = 0
+        self._last_result_time = 0.0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self.run, name="MixWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, source, job):
+        with self._condition:
+            # replaces (abandons) any job of the same source that has not started yet
+            self._pending[source] = job
+            self._latest = job
+            self._generation += 1
+            self._condition.notify()
+
+    def superseded(self, generation):
+        return self._generation != generation
+
+    def idle(self):
+        with self._condition:
+            return not self._pending
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                jobs, self._pending = self._pending, {}
+                latest = self._latest
+                generation = self._generation
+
+            # the mix runs here, not in the thread that started the profiler
+            with instrumentation.thread_profile():
+                try:
+                    # jobs deferred by a lookup hit are older than the pending ones of the same source
+                    jobs = {**self._deferred, **jobs}
+                    self._deferred = {}
+                    result = self.lookup_function(jobs, latest) if self.lookup_function else None
+                    if result is not None:
+                        self._deferred = jobs
+                        self._last_result_time = time.monotonic()
+                        self.resultReady.emit(latest, result)
+                        continue
+                    for job in jobs.values():
+                        self.update_function(job)
+                    # newer parameters arrived while updating: fold them in before paying for a compose
+                    if self.superseded(generation) and not self.overdue():
+                        continue
+                    result = self.compose_function(latest)
+                except Exception as e:
+                    print("Exception:", e)
+                    continue
+
+            if self.superseded(generation) and not self.overdue():
+                continue
+            self._last_result_time = time.monotonic()
+            self.resultReady.emit(latest, result)
+
+    def overdue(self):
+        return time.monotonic() - self._last_result_time > self.max_latency